@@ -13,11 +13,18 @@ assert get_json_sem_hash(d3) == get_json_sem_hash(d4)
 This prints hash value 'e17246aa9136a25581fb859fdeb2dd1da4cda9a221124cd27208646749b85cd7'
 for both d3 and d4. 
 
+The hash of newline-delimited JSON (one document per line) can be computed from
+the command line, optionally using several processes:
+```
+python -m json_sem_hash --workers 4 --algorithm md5 events.ndjson
+```
+
 If you find that `get_json_sem_hash()` doesn't return the same hash for 2 json structures 
 that *you* think are in fact "semantically equivalent", please raise an issue!
 
 The idea for this approach was inspired by https://github.com/fraunhoferfokus/JSum. It 
-probably needs Python 3.5+ due to type hinting. Clearly the type hinting is not essential, 
+needs Python 3.7+ (str.isascii(), insertion-ordered dicts) and uses type hinting. 
+Clearly the type hinting is not essential, 
 so if it's presence is a hindrance for lots of people, please raise an issue. 
 
 (C) Oliver Schoenborn
@@ -30,13 +37,122 @@ community can benefit the same way you benefit from this file.
 GIT_COMMIT: <REPLACE WHEN FILE COPIED FROM GITHUB>
 """
 
-from typing import Union, Dict, List
+from argparse import ArgumentParser
+from functools import partial
+from json.decoder import scanstring, JSONDecoder
+from json.encoder import encode_basestring
+from array import array
+from decimal import Decimal
+from math import isfinite
+from struct import Struct
+from multiprocessing import Pool
+from operator import itemgetter
+from typing import (
+    Union, Dict, List, Iterator, Iterable, Tuple, Optional, Callable, BinaryIO, Sequence)
+import codecs
 import hashlib
+import io
+import json
+import os
+import re
+import sqlite3
+import struct
+import sys
+import time
+import zlib
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 JsonType = Union[str, int, float, List['JsonType'], 'JsonTree']
 JsonTree = Dict[str, JsonType]
 StrTreeType = Union[str, List['StrTreeType'], 'StrTree']
 StrTree = Dict[str, StrTreeType]
+PathPattern = Union[str, Sequence[str]]
+
+# approximate number of characters of canonical text given to the hasher per update()
+DEFAULT_CHUNK_SIZE = 64 * 1024
+# number of documents sent to a worker process at a time by get_json_sem_hashes()
+DEFAULT_DOCS_PER_TASK = 64
+# max number of dict shapes (tuples of keys) for which the sorted keys are cached
+KEY_ORDER_CACHE_SIZE = 4096
+
+# lists of numbers at least this long are converted to canonical text in bulk
+MIN_NUMBERS_LIST_LEN = 8
+# str and bytes leaves at least this long are given to the hasher directly, in
+# memoryview chunks of this size, instead of being copied into the canonical text;
+# hashlib releases the GIL while it hashes them, so threads hashing documents with
+# large leaves (eg base64 blobs) run in parallel
+LARGE_LEAF_SIZE = 1024 * 1024
+
+# canonical forms that can be hashed, see get_json_sem_hash()
+ENCODINGS = ('repr', 'jcs', 'tagged')
+
+# number of hash functions of MinHash signatures, and number of LSH bands they
+# are split into, see JsonSimilarityIndex
+DEFAULT_NUM_PERM = 128
+DEFAULT_NUM_BANDS = 16
+
+
+# hashlib-style constructors by name, for get_hasher(); see register_hasher()
+HASHERS = {
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256,
+    'sha512': hashlib.sha512,
+    'blake2b': hashlib.blake2b,
+    'blake2s': hashlib.blake2s,
+    # for non-cryptographic use (dedup, cache keys): short digests of blake2b, which is
+    # fast on all CPUs (sha256 can be faster on CPUs with SHA extensions; the time to
+    # walk the document usually dominates anyway: see json_sem_hash_speed.py)
+    'fast64': partial(hashlib.blake2b, digest_size=8),
+    'fast128': partial(hashlib.blake2b, digest_size=16),
+}
+if xxhash is not None:
+    HASHERS.update(xxh64=xxhash.xxh64, xxh3_64=xxhash.xxh3_64, xxh3_128=xxhash.xxh3_128)
+
+
+def register_hasher(name: str, hasher):
+    """
+    Make a hashlib-style constructor available by name to get_hasher(), and so
+    to all functions that accept a hasher name, and to the command line. The
+    constructor must accept an optional initial bytes-like argument and return
+    an object with update(), digest(), hexdigest() and digest_size, like the
+    constructors of hashlib. It must be picklable to be used by worker processes.
+    """
+    HASHERS[name] = hasher
+
+
+def get_hasher(algorithm: str, digest_size: int = None):
+    """
+    Get the hashlib-style constructor for the given algorithm name: a name in
+    HASHERS (eg 'sha256', 'md5', 'fast64', or 'xxh3_64' if the xxhash package
+    is installed), or any other name accepted by hashlib.new() (eg 'sha3_256').
+    Raises ValueError if there is no such algorithm.
+
+    The digest_size (in bytes) can be given for 'blake2b' (1 to 64) and
+    'blake2s' (1 to 32). The returned constructor is picklable if the algorithm
+    is in HASHERS or hashlib has an attribute of that name.
+
+    Algorithms without a fixed digest size (eg 'shake_128', whose digest()
+    needs a length) cannot be used, and also raise ValueError.
+    """
+    hasher = HASHERS.get(algorithm)
+    if hasher is None and algorithm in hashlib.algorithms_available:
+        hasher = getattr(hashlib, algorithm, None)
+    if hasher is None:
+        hashlib.new(algorithm)  # raises ValueError if unknown
+        hasher = partial(hashlib.new, algorithm)
+    if not hasher().digest_size:
+        raise ValueError('Hash algorithm {} has no fixed digest size'.format(algorithm))
+    if digest_size is not None:
+        if hasher not in (hashlib.blake2b, hashlib.blake2s):
+            raise ValueError('Digest size can only be given for blake2b and blake2s')
+        hasher = partial(hasher, digest_size=digest_size)
+        hasher().digest()  # raises ValueError if invalid size
+    return hasher
 
 
 def sorted_dict_str(data: JsonType) -> StrTreeType:
@@ -48,5 +164,3057 @@ def sorted_dict_str(data: JsonType) -> StrTreeType:
         return str(data)
 
 
-def get_json_sem_hash(data: JsonTree, hasher=hashlib.sha256) -> str:
-    return hasher(bytes(repr(sorted_dict_str(data)), 'UTF-8')).hexdigest()
+_UNORDERED, _INCLUDE, _EXCLUDE = 'unordered', 'include', 'exclude'  # kinds of path patterns
+_MAX_PATH_MATCHERS = 64
+_path_matchers = {}  # (unordered, include, exclude) patterns as tuples -> _PathMatcher
+_ANY_INDEX = object()  # stands for the list indices (int keys) that no pattern names
+
+
+class _PathNode:
+    """Node of the trie of the path patterns of a _PathMatcher"""
+    __slots__ = ('children', 'loops', 'ends', 'below')
+
+    def __init__(self, loops: bool = False):
+        self.children = {}  # pattern token -> _PathNode
+        self.loops = loops  # True for the node of a '**' token, which matches any key again
+        self.ends = set()  # kinds of the patterns that end at this node
+        self.below = set()  # kinds of the patterns that end below this node (or at it, if loops)
+
+
+class _PathState:
+    """
+    State of a _PathMatcher at a path of a document: the trie nodes that match
+    the path, and what follows for the value at that path.
+    """
+    __slots__ = ('matcher', 'nodes', 'include_done', 'unordered', 'filters', 'free',
+                 'has_index_tokens', 'next_states')
+
+    def __init__(self, matcher: '_PathMatcher', nodes: frozenset, include_done: bool):
+        self.matcher = matcher
+        self.nodes = nodes
+        # True if the value is included (or there are no include patterns)
+        self.include_done = include_done
+        # True if the value is an unordered list
+        self.unordered = any(_UNORDERED in node.ends for node in nodes)
+        # True if some items of the value can be left out
+        self.filters = not include_done or any(_EXCLUDE in node.below for node in nodes)
+        # True if no pattern applies to the value or below it
+        self.free = include_done and not nodes
+        self.has_index_tokens = any(token.isdigit() for node in nodes for token in node.children)
+        self.next_states = {}
+
+    def step(self, key) -> Optional['_PathState']:
+        """
+        Get the state at the item of the given key (or list index) of the value;
+        None if the item is left out.
+        """
+        if self.free:
+            return self
+        if type(key) is not str:
+            key = _ANY_INDEX if type(key) is int and not self.has_index_tokens else str(key)
+        state = self.next_states.get(key, _END)
+        if state is _END:
+            state = self.matcher.get_next_state(self, key)
+            if len(self.next_states) >= KEY_ORDER_CACHE_SIZE:
+                self.next_states.clear()
+            self.next_states[key] = state
+        return state
+
+    def keeps(self, key, value) -> bool:
+        """
+        True if the item of the given key and value is hashed: it is not left out,
+        and it is included, or is a container that can hold included values.
+        """
+        state = self.step(key)
+        return state is not None and (
+            state.include_done or type(value) is dict or type(value) is list)
+
+
+class _PathMatcher:
+    """
+    Matches the paths of a document (keys and list indices from the root) against
+    path patterns during a walk of the document. A pattern is a dotted string like
+    'spec.containers.*.env', where '*' matches any one key or list index, and '**'
+    any number of them (including none), or a sequence of keys (for keys that
+    contain a dot). The empty string (or empty sequence) is the root.
+
+    The patterns are compiled into a trie. The state at a path is the set of
+    trie nodes that match it; the states are created as the walk reaches them
+    and remember the next state of each key, so that going from a container to
+    an item usually costs one dict lookup. Patterns are of 3 kinds: unordered
+    (lists hashed as multisets), include (only included values, and the
+    containers that lead to them, are hashed), and exclude (excluded values are
+    left out, along with their key or list item; exclude wins over include).
+    """
+
+    def __init__(self, unordered: Iterable[PathPattern] = (), include: Iterable[PathPattern] = (),
+                 exclude: Iterable[PathPattern] = ()):
+        root = _PathNode()
+        include = list(include)
+        for kind, patterns in ((_UNORDERED, unordered), (_INCLUDE, include), (_EXCLUDE, exclude)):
+            for pattern in patterns:
+                node = root
+                for token in _split_path_pattern(pattern):
+                    node.below.add(kind)
+                    child = node.children.get(token)
+                    if child is None:
+                        child = node.children[token] = _PathNode(loops=token == '**')
+                    node = child
+                node.ends.add(kind)
+                if node.loops:
+                    node.below.add(kind)
+
+        self._states = {}
+        nodes = self._get_closure([root])
+        if any(_EXCLUDE in node.ends for node in nodes):
+            raise ValueError('The root of a document cannot be excluded')
+        include_done = not include or any(_INCLUDE in node.ends for node in nodes)
+        self.root = self._get_state(nodes, include_done)
+
+    @staticmethod
+    def _get_closure(nodes: Iterable[_PathNode]) -> frozenset:
+        """Get nodes and the '**' nodes that follow them (since '**' can match no key)"""
+        closure = set()
+        nodes = list(nodes)
+        while nodes:
+            node = nodes.pop()
+            if node not in closure:
+                closure.add(node)
+                double_star = node.children.get('**')
+                if double_star is not None:
+                    nodes.append(double_star)
+        return frozenset(closure)
+
+    def _get_state(self, nodes: frozenset, include_done: bool) -> _PathState:
+        if include_done:
+            # include patterns no longer matter
+            nodes = frozenset(node for node in nodes if (node.ends | node.below) - {_INCLUDE})
+        state = self._states.get((nodes, include_done))
+        if state is None:
+            state = self._states[nodes, include_done] = _PathState(self, nodes, include_done)
+        return state
+
+    def get_next_state(self, state: _PathState, key) -> Optional[_PathState]:
+        """Same as state.step(key) but without the cache; key is a str or _ANY_INDEX"""
+        nodes = []
+        for node in state.nodes:
+            children = node.children
+            if key is not _ANY_INDEX and key in children:
+                nodes.append(children[key])
+            if '*' in children:
+                nodes.append(children['*'])
+            if node.loops:
+                nodes.append(node)
+        nodes = self._get_closure(nodes)
+        if any(_EXCLUDE in node.ends for node in nodes):
+            return None
+        include_done = state.include_done or any(_INCLUDE in node.ends for node in nodes)
+        if not include_done and not any(_INCLUDE in node.below for node in nodes):
+            return None
+        return self._get_state(nodes, include_done)
+
+
+def _split_path_pattern(pattern: PathPattern) -> Tuple[str, ...]:
+    if isinstance(pattern, str):
+        return tuple(pattern.split('.')) if pattern else ()
+    return tuple(map(str, pattern))
+
+
+def _get_path_matcher(unordered: Iterable[PathPattern], include: Iterable[PathPattern],
+                      exclude: Iterable[PathPattern]) -> _PathMatcher:
+    """
+    Get the _PathMatcher of the given patterns, from a cache so that the states
+    it created in earlier walks are reused. A bare str is a single pattern,
+    not an iterable of one-character patterns.
+    """
+    key = tuple(tuple(sorted(set(map(_split_path_pattern,
+                                     (patterns,) if isinstance(patterns, str) else patterns))))
+                for patterns in (unordered, include, exclude))
+    matcher = _path_matchers.get(key)
+    if matcher is None:
+        matcher = _PathMatcher(*key)
+        if len(_path_matchers) >= _MAX_PATH_MATCHERS:
+            _path_matchers.clear()
+        _path_matchers[key] = matcher
+    return matcher
+
+
+_END = object()  # marks the end of an iterator, for next()
+
+
+class _NoNdarray:
+    """Stands for numpy.ndarray when numpy is not imported: no value has this type"""
+
+
+def _get_ndarray_type() -> type:
+    """
+    Get numpy.ndarray if numpy has been imported. Otherwise no value can be a
+    numpy array, so numpy is not imported here (that takes longer than
+    importing this module).
+    """
+    return getattr(sys.modules.get('numpy'), 'ndarray', _NoNdarray)
+
+
+def _get_base_ndarray(value) -> Union['numpy.ndarray', list]:
+    """
+    Get value, an instance of a subclass of numpy.ndarray (eg numpy.memmap), as
+    a plain numpy array; or as a list if it is a masked array (masked items are
+    None). The str() of such arrays is truncated, so it cannot be hashed.
+    """
+    numpy = sys.modules['numpy']
+    if isinstance(value, numpy.ma.MaskedArray):
+        return value.tolist()
+    return numpy.asarray(value)
+
+
+def _sort_keys(keys: Iterable) -> Tuple[List, List[str]]:
+    """
+    Get the sorted keys of a dict and the canonical text that precedes the value
+    of each key: "{'key': " for the first key, ", 'key': " for the others.
+    """
+    sorted_keys = sorted(keys)
+    prefixes = [', ' + repr(key) + ': ' for key in sorted_keys]
+    prefixes[0] = '{' + prefixes[0][2:]
+    return sorted_keys, prefixes
+
+
+class _KeyOrderCache:
+    """
+    Cache of the key orders given by sort_keys(keys) (eg sorted keys and the
+    canonical text that precedes each value), so that dicts that have the same
+    keys in the same order (eg records of a list) are sorted once. Only dicts
+    with str keys are cached (1 == True but their repr differ). All entries are
+    evicted when the cache has KEY_ORDER_CACHE_SIZE entries (evicting only the
+    oldest one gets slow when most lookups are misses).
+    """
+
+    def __init__(self, sort_keys: Callable[[Iterable], tuple]):
+        self.sort_keys = sort_keys
+        self._cache = {}
+
+    def _add(self, keys: tuple, key_order: tuple):
+        if all(type(key) is str for key in keys):
+            if len(self._cache) >= KEY_ORDER_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[keys] = key_order
+
+    def get(self, keys: tuple) -> tuple:
+        """Same as sort_keys(keys) but through the cache"""
+        key_order = self._cache.get(keys)
+        if key_order is None:
+            key_order = self.sort_keys(keys)
+            if KEY_ORDER_CACHE_SIZE:
+                self._add(keys, key_order)
+        return key_order
+
+    def get_sorter(self) -> Callable[[Iterable], tuple]:
+        """
+        Get a sort_keys() function for the dicts of one walk: through the cache,
+        unless most of its lookups miss (then the cache only costs).
+        """
+        if not KEY_ORDER_CACHE_SIZE:
+            return self.sort_keys
+        sort_keys = self.sort_keys
+        lookup = self._cache.get
+        num_lookups = num_misses = 0
+        use_cache = True
+
+        def sort(keys: Iterable) -> tuple:
+            nonlocal num_lookups, num_misses, use_cache
+            if not use_cache:
+                return sort_keys(keys)
+            keys = tuple(keys)
+            key_order = lookup(keys)
+            num_lookups += 1
+            if key_order is None:
+                key_order = sort_keys(keys)
+                self._add(keys, key_order)
+                num_misses += 1
+                if num_misses > 100 and num_misses * 2 > num_lookups:
+                    use_cache = False
+            return key_order
+
+        return sort
+
+
+_key_orders = _KeyOrderCache(_sort_keys)
+
+
+# the walks check that data has no circular reference when their number of open
+# containers reaches this, then twice that, etc (a circular reference makes it grow forever)
+_CYCLE_CHECK_DEPTH = 1000
+
+
+def _check_no_cycle(containers: Sequence) -> int:
+    """
+    Raise ValueError if a container is more than once in containers, the open
+    containers of a walk (each one is in the previous one), ie if it contains
+    itself. Returns the depth for the next check.
+    """
+    if len(set(map(id, containers))) < len(containers):
+        raise ValueError('Circular reference in JSON data')
+    return 2 * len(containers)
+
+
+def _iter_canonical_chunks(data: JsonType, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                           unordered: Union[bool, _PathMatcher] = None,
+                           hasher=None, memo: bool = False, columnar: bool = False,
+                           packed_numbers: bool = False,
+                           large_leaves: bool = False) -> Iterator[Union[str, memoryview]]:
+    """
+    Yield the canonical text of data, ie repr(sorted_dict_str(data)), in chunks of
+    roughly chunk_size characters, without building the sorted string tree. The
+    traversal uses an explicit stack so there is no limit on depth, and no
+    per-node function call.
+
+    Lists that are unordered (all lists if unordered is True, else those whose
+    path matches an unordered pattern of the _PathMatcher) are replaced by the
+    text of their multiset hash: the sum, modulo 2 ** digest bits, of the
+    digests of their items. Addition is commutative, so item order does not
+    matter and no sorting is needed. The text starts with '<', which no other
+    canonical text does.
+
+    If unordered is a _PathMatcher, the items of dicts and lists that its
+    include and exclude patterns leave out are skipped (not walked).
+
+    If memo is True, the text of containers that are referenced more than once
+    in data (the same Python object) is produced once and reused. This is not
+    possible when unordered is a _PathMatcher, since the text then depends on
+    the path, so memo is ignored in that case.
+
+    If columnar is True, lists of records (dicts that all have the same keys)
+    are replaced by the text of their columnar hash, see _get_columnar_str().
+
+    Lists of numbers are converted to text in bulk, see _get_numbers_list_str().
+    Numpy arrays are hashed as the equivalent (nested) lists.
+
+    If large_leaves is True, the canonical bytes of large str and bytes leaves
+    are yielded as memoryview chunks between the text chunks, when possible
+    (see _get_large_leaf_parts()).
+    """
+    pieces = []
+    append = pieces.append
+    size = 0
+    track_path = unordered is not None and unordered is not True
+    # path state of value, and of the open containers, if track_path; the state
+    # is free below the paths that no pattern can match, so it is kept as is
+    state = unordered.root if track_path else None
+    states = []
+    # per open container: (iterator of keys and their prefix, dict), (iterator of items, None), or
+    # (iterator of items, multiset state) for unordered lists; also (None, capture
+    # state) below a shared container whose text is being captured
+    stack = []
+    num_buffered = 0  # number of multiset and capture frames in stack
+    opened = []  # the dicts and lists of stack, for _check_no_cycle()
+    next_cycle_check = _CYCLE_CHECK_DEPTH
+    shared = _find_shared_containers(data) if memo and not track_path else None
+    shared_texts = {}
+    capturing = set()
+    sort_keys = _key_orders.get_sorter()
+    ndarray = _get_ndarray_type()
+    value = data
+    prefix = ''
+    while True:
+        value_type = type(value)
+        if shared and (value_type is dict or value_type is list) and id(value) in shared:
+            text = shared_texts.get(id(value))
+            if text is None:
+                if id(value) in capturing:
+                    raise ValueError('Circular reference in JSON data')
+                capturing.add(id(value))
+                stack.append((None, _Capture(pieces, prefix, id(value))))
+                num_buffered += 1
+                pieces = []
+                append = pieces.append
+                prefix = ''
+            else:
+                value_type = None
+                append(prefix + text)
+                size += len(prefix) + len(text)
+
+        if value_type is dict:
+            keys = value
+            if track_path and state.filters:
+                keys = [key for key in value if state.keeps(key, value[key])]
+            if keys:
+                keys = zip(*sort_keys(keys))
+                key, key_prefix = next(keys)
+                append(prefix + key_prefix)
+                size += len(prefix) + len(key_prefix)
+                stack.append((keys, value))
+                opened.append(value)
+                if len(opened) >= next_cycle_check:
+                    next_cycle_check = _check_no_cycle(opened)
+                if track_path:
+                    states.append(state)
+                    if not state.free:
+                        state = state.step(key)
+                value = value[key]
+                prefix = ''
+                continue
+            append(prefix + '{}')
+            size += len(prefix) + 2
+
+        elif value_type is list:
+            # (index, item) of the items that are kept, if some can be left out
+            kept = None
+            if track_path and state.filters:
+                kept = [(index, item) for index, item in enumerate(value)
+                        if state.keeps(index, item)]
+            if unordered is True or (track_path and state.unordered):
+                num_items = len(value) if kept is None else len(kept)
+                if not num_items:
+                    text = _get_multiset_str(0, 0, hasher)
+                    append(prefix + text)
+                    size += len(prefix) + len(text)
+                else:
+                    # each item's text is collected separately, to be hashed
+                    if kept is not None:
+                        items = iter(kept)
+                    else:
+                        items = enumerate(value) if track_path else iter(value)
+                    stack.append((items, _Multiset(pieces, prefix, num_items)))
+                    num_buffered += 1
+                    opened.append(value)
+                    if len(opened) >= next_cycle_check:
+                        next_cycle_check = _check_no_cycle(opened)
+                    pieces = []
+                    append = pieces.append
+                    value = next(items)
+                    if track_path:
+                        states.append(state)
+                        index, value = value
+                        if not state.free:
+                            state = state.step(index)
+                    prefix = ''
+                    continue
+            elif kept is not None:
+                if kept:
+                    items = iter(kept)
+                    append(prefix + '[')
+                    size += len(prefix) + 1
+                    stack.append((items, None))
+                    opened.append(value)
+                    if len(opened) >= next_cycle_check:
+                        next_cycle_check = _check_no_cycle(opened)
+                    states.append(state)
+                    index, value = next(items)
+                    if not state.free:
+                        state = state.step(index)
+                    prefix = ''
+                    continue
+                append(prefix + '[]')
+                size += len(prefix) + 2
+            elif columnar and _is_record_list(value):
+                text = _get_columnar_str(value, hasher)
+                append(prefix + text)
+                size += len(prefix) + len(text)
+            elif len(value) >= MIN_NUMBERS_LIST_LEN and type(value[0]) in _ARRAY_TYPE_CODES and (
+                    _is_numbers_list(value)):
+                text = _get_numbers_list_str(value, hasher, packed_numbers)
+                if prefix:
+                    append(prefix)
+                append(text)
+                size += len(prefix) + len(text)
+            elif value:
+                items = enumerate(value) if track_path else iter(value)
+                append(prefix + '[')
+                size += len(prefix) + 1
+                stack.append((items, None))
+                opened.append(value)
+                if len(opened) >= next_cycle_check:
+                    next_cycle_check = _check_no_cycle(opened)
+                value = next(items)
+                if track_path:
+                    states.append(state)
+                    index, value = value
+                    if not state.free:
+                        state = state.step(index)
+                prefix = ''
+                continue
+            else:
+                append(prefix + '[]')
+                size += len(prefix) + 2
+
+        elif value_type is ndarray:
+            type_code = _get_ndarray_type_code(value) if packed_numbers else None
+            if type_code is not None:
+                packed = value.astype('<f8' if type_code == 'd' else '<i8', order='C', copy=False)
+                text = _get_packed_str(type_code, len(value), memoryview(packed), hasher)
+                append(prefix + text)
+                size += len(prefix) + len(text)
+            else:
+                value = value.tolist()
+                continue
+
+        elif isinstance(value, ndarray):  # a subclass, eg numpy.memmap
+            value = _get_base_ndarray(value)
+            continue
+
+        elif value_type is not None:
+            parts = None
+            if large_leaves and (value_type is str or value_type is bytes) and (
+                    len(value) >= LARGE_LEAF_SIZE and not num_buffered):
+                parts = _get_large_leaf_parts(value)
+            if parts is not None:
+                before, leaf, after = parts
+                append(prefix + before)
+                yield ''.join(pieces)
+                pieces.clear()
+                yield from _iter_buffer_chunks(leaf)
+                append(after)
+                size = len(after)
+            else:
+                text = repr(str(value))
+                if prefix:
+                    append(prefix)
+                append(text)
+                size += len(prefix) + len(text)
+
+        # value is done, move to the next one
+        while stack:
+            if size >= chunk_size and not num_buffered:
+                yield ''.join(pieces)
+                pieces.clear()
+                size = 0
+            items, container = stack[-1]
+            if items is None:
+                # shared container done: keep its text
+                stack.pop()
+                num_buffered -= 1
+                text = ''.join(pieces)
+                shared_texts[container.container_id] = text
+                capturing.discard(container.container_id)
+                pieces = container.parent_pieces
+                append = pieces.append
+                append(container.prefix + text)
+                size += len(container.prefix)  # (text was counted as it was captured)
+                continue
+            if type(container) is _Multiset:
+                container.add(hasher(''.join(pieces).encode('UTF-8')).digest())
+                pieces.clear()
+            item = next(items, _END)
+            if item is _END:
+                stack.pop()
+                opened.pop()
+                if container is None:
+                    append(']')
+                    size += 1
+                elif type(container) is _Multiset:
+                    num_buffered -= 1
+                    pieces = container.parent_pieces
+                    append = pieces.append
+                    text = _get_multiset_str(container.num_items, container.total, hasher)
+                    append(container.prefix + text)
+                    size += len(container.prefix) + len(text)
+                else:
+                    append('}')
+                    size += 1
+                if track_path:
+                    states.pop()
+                continue
+
+            if type(container) is dict:
+                key, prefix = item
+                value = container[key]
+                if track_path:
+                    state = states[-1]
+                    if not state.free:
+                        state = state.step(key)
+            else:
+                prefix = ', ' if container is None else ''
+                if track_path:
+                    index, value = item
+                    state = states[-1]
+                    if not state.free:
+                        state = state.step(index)
+                else:
+                    value = item
+            break
+        else:
+            break
+
+    if pieces:
+        yield ''.join(pieces)
+
+
+# printable ASCII bytes other than quotes and backslash, which repr() may escape
+_PLAIN_ASCII = bytes(range(0x20, 0x7f)).translate(None, b'\'"\\')
+
+
+def _get_large_leaf_parts(value: Union[str, bytes]) -> Optional[Tuple[str, bytes, str]]:
+    """
+    Get (text before, leaf bytes, text after) such that they make the canonical
+    text of a str or bytes leaf, repr(str(value)), with the leaf bytes being
+    value itself (bytes) or its ASCII encoding (str), ie without any escaping,
+    str() or repr() of the leaf. That is possible if the leaf is only printable
+    ASCII other than quotes and backslash, as base64 text is (double quotes
+    are fine in str leaves); else returns None.
+    """
+    if type(value) is str:
+        if value.isascii() and value.isprintable() and "'" not in value and '\\' not in value:
+            return "'", value.encode('ascii'), "'"
+    elif not value.translate(None, _PLAIN_ASCII):
+        return '"b\'', value, '\'"'
+    return None
+
+
+def _iter_buffer_chunks(buffer: bytes) -> Iterator[memoryview]:
+    """Yield memoryviews of buffer of LARGE_LEAF_SIZE bytes, without copying"""
+    view = memoryview(buffer)
+    for start in range(0, len(view), LARGE_LEAF_SIZE):
+        yield view[start:start + LARGE_LEAF_SIZE]
+
+
+class _Multiset:
+    """State of an unordered list being hashed by _iter_canonical_chunks()"""
+    __slots__ = ('parent_pieces', 'prefix', 'num_items', 'total')
+
+    def __init__(self, parent_pieces: List[str], prefix: str, num_items: int):
+        self.parent_pieces = parent_pieces
+        self.prefix = prefix
+        self.num_items = num_items
+        self.total = 0
+
+    def add(self, digest: bytes):
+        self.total += int.from_bytes(digest, 'big')
+
+
+class _Capture:
+    """State of a shared container whose text is being captured by _iter_canonical_chunks()"""
+    __slots__ = ('parent_pieces', 'prefix', 'container_id')
+
+    def __init__(self, parent_pieces: List[str], prefix: str, container_id: int):
+        self.parent_pieces = parent_pieces
+        self.prefix = prefix
+        self.container_id = container_id
+
+
+def _find_shared_containers(data: JsonType) -> set:
+    """Get the ids of the dicts and lists that are referenced more than once in data"""
+    seen = set()
+    shared = set()
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        value_type = type(value)
+        if value_type is dict or value_type is list:
+            if id(value) in seen:
+                shared.add(id(value))
+                continue
+            seen.add(id(value))
+            stack.extend(value.values() if value_type is dict else value)
+    return shared
+
+
+def _get_multiset_str(num_items: int, total: int, hasher) -> str:
+    digest_size = hasher().digest_size
+    total %= 1 << (8 * digest_size)
+    return '<multiset:{}:{:0{}x}>'.format(num_items, total, 2 * digest_size)
+
+
+def _get_canonical_str(data: JsonType, hasher=None, columnar: bool = False) -> str:
+    return ''.join(_iter_canonical_chunks(data, sys.maxsize, None, hasher, columnar=columnar))
+
+
+# type codes of array for columns of ints and floats; digests must not depend on platform
+_ARRAY_TYPE_CODES = {int: 'q', float: 'd'}
+_SWAP_BYTES = sys.byteorder == 'big'
+_NUMBER_TYPES = frozenset(_ARRAY_TYPE_CODES)
+# the types of the values that json.loads() gives, other than dict and list
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def _is_record_list(data: list) -> bool:
+    """True if data has at least 2 items and they are all dicts with the same (non-empty) keys"""
+    if len(data) < 2 or type(data[0]) is not dict or not data[0]:
+        return False
+    keys = data[0].keys()
+    num_keys = len(keys)
+    return all(type(record) is dict and len(record) == num_keys and record.keys() == keys
+               for record in data)
+
+
+def _pack_numbers(data: list, number_type: type) -> Optional[array]:
+    """
+    Get data, a list of ints or floats (number_type), as a little-endian array of
+    int64 or float64; None if they are ints that don't fit in 64 bits.
+    """
+    try:
+        packed = array(_ARRAY_TYPE_CODES[number_type], data)
+    except OverflowError:
+        return None
+    if _SWAP_BYTES:
+        packed.byteswap()
+    return packed
+
+
+def _get_packed_digest(type_code: str, packed: Union[array, memoryview], hasher) -> bytes:
+    hash_obj = hasher(type_code.encode('UTF-8'))
+    hash_obj.update(packed)  # no copy of the buffer
+    return hash_obj.digest()
+
+
+def _get_packed_str(type_code: str, num_items: int, packed: Union[array, memoryview],
+                    hasher) -> str:
+    return '<array:{}:{}:{}>'.format(
+        type_code, num_items, _get_packed_digest(type_code, packed, hasher).hex())
+
+
+def _get_ndarray_type_code(data: 'numpy.ndarray',
+                           min_len: int = MIN_NUMBERS_LIST_LEN) -> Optional[str]:
+    """
+    Get the array type code of the packed form of data, a numpy array, if
+    it has one: same as the list of Python numbers that data.tolist() would give.
+    """
+    if data.ndim != 1 or len(data) < min_len:
+        return None
+    kind, itemsize = data.dtype.kind, data.dtype.itemsize
+    if kind == 'f' and itemsize <= 8:
+        return 'd'
+    if kind == 'i' or (kind == 'u' and itemsize < 8):
+        return 'q'
+    return None
+
+
+def _is_numbers_list(data: list) -> bool:
+    return set(map(type, data)) <= _NUMBER_TYPES
+
+
+def _get_numbers_list_str(data: list, hasher, packed_numbers: bool) -> str:
+    """
+    Get the canonical text of data, a list of ints and floats. The str() of a
+    number never contains a quote, so this is done in bulk rather than one
+    repr(str()) per item. If packed_numbers is True, and data contains only
+    ints that fit in 64 bits or only floats, it is hashed as a packed array
+    instead; this is a different text than the list's, so it gives different
+    hash values.
+    """
+    if packed_numbers:
+        types = set(map(type, data))
+        if len(types) == 1:
+            number_type = types.pop()
+            packed = _pack_numbers(data, number_type)
+            if packed is not None:
+                return _get_packed_str(_ARRAY_TYPE_CODES[number_type], len(data), packed, hasher)
+    return "['" + "', '".join(map(str, data)) + "']"
+
+
+def _get_column_digest(column: list, hasher) -> bytes:
+    """
+    Get the digest of a column of values. A column of ints that fit in 64 bits,
+    or of floats, is hashed as a packed little-endian array; other columns of
+    scalars as the canonical text of their values, without walking them one by
+    one; and columns containing dicts, lists or numpy arrays through their
+    canonical text.
+    """
+    types = set(map(type, column))
+    if len(types) == 1:
+        number_type = types.pop()
+        if number_type in _ARRAY_TYPE_CODES:
+            packed = _pack_numbers(column, number_type)
+            if packed is not None:
+                return _get_packed_digest(_ARRAY_TYPE_CODES[number_type], packed, hasher)
+        types.add(number_type)
+
+    if types <= _SCALAR_TYPES:
+        text = ', '.join(map(repr, map(str, column)))
+    else:
+        text = ', '.join(_get_canonical_str(value, hasher, columnar=True) for value in column)
+    return hasher(b's' + text.encode('UTF-8')).digest()
+
+
+def _get_columnar_str(records: List[dict], hasher) -> str:
+    """
+    Get the text of a list of records hashed by columns: the digest of each
+    column (the values of one key in all records, in record order), by sorted
+    key. The text starts with '<', which no other canonical text does.
+    """
+    sorted_keys, key_prefixes = _sort_keys(records[0].keys())
+    column_texts = (key_prefix + _get_column_digest(list(map(itemgetter(key), records)),
+                                                    hasher).hex()
+                    for key, key_prefix in zip(sorted_keys, key_prefixes))
+    return '<columns:{}:{}>'.format(len(records), ''.join(column_texts) + '}')
+
+
+def _get_utf16_sort_key(key: str) -> bytes:
+    return key.encode('utf-16-be')
+
+
+def _sort_jcs_keys(keys: Iterable) -> Tuple[List[str], List[str]]:
+    """
+    Get the keys of a dict in the order required by RFC 8785, by UTF-16 code
+    units, and the canonical JSON that precedes the value of each key: '{"key":'
+    for the first key, ',"key":' for the others. The order of UTF-16 code units
+    is the same as the order of Python str (by code point) unless some keys have
+    characters beyond U+FFFF, so the slower sort is only done then.
+    """
+    sorted_keys = sorted(keys)
+    try:
+        widest = max(map(max, filter(None, sorted_keys)), default='')
+        prefixes = [',' + encode_basestring(key) + ':' for key in sorted_keys]
+    except TypeError:
+        raise TypeError('Keys of canonical JSON must be str, got {!r}'.format(
+            sorted_keys)) from None
+    if widest > '\uffff':
+        sorted_keys, prefixes = map(list, zip(*sorted(
+            zip(sorted_keys, prefixes), key=lambda item: _get_utf16_sort_key(item[0]))))
+    prefixes[0] = '{' + prefixes[0][1:]
+    return sorted_keys, prefixes
+
+
+_jcs_key_orders = _KeyOrderCache(_sort_jcs_keys)
+
+
+def _get_jcs_float(value: float) -> str:
+    """
+    Get the RFC 8785 text of a float: the shortest digits that read back as
+    the same float (as repr() does), in the format of ECMAScript's
+    Number.prototype.toString(), eg 1.0 -> '1', 1e+16 -> '10000000000000000',
+    1e-07 -> '1e-7'. NaN and infinities are not JSON so they raise ValueError.
+    """
+    if not isfinite(value):
+        raise ValueError('{!r} is not allowed in canonical JSON'.format(value))
+    text = repr(value)
+    if 'e' not in text:
+        if text.endswith('.0'):
+            text = text[:-2]
+            if text == '-0':
+                return '0'
+        return text
+
+    # repr() uses exponents from 1e+16 and below 1e-04, ECMAScript from 1e+21 and below 1e-06
+    mantissa, _, exponent = text.partition('e')
+    sign = '-' if mantissa[0] == '-' else ''
+    digits = mantissa.lstrip('-').replace('.', '')
+    num_digits = len(digits)
+    point = int(exponent) + 1  # number of digits before the decimal point
+    if num_digits <= point <= 21:
+        text = digits + '0' * (point - num_digits)
+    elif 0 < point <= 21:
+        text = digits[:point] + '.' + digits[point:]
+    elif -6 < point <= 0:
+        text = '0.' + '0' * -point + digits
+    else:
+        text = digits[0] + ('.' + digits[1:] if num_digits > 1 else '') + 'e{:+d}'.format(point - 1)
+    return sign + text
+
+
+def _get_jcs_scalar(value) -> str:
+    """Get the RFC 8785 text of a value that is not a container"""
+    value_type = type(value)
+    if value_type is str:
+        return encode_basestring(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is float:
+        return _get_jcs_float(value)
+    if value is None:
+        return 'null'
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return _get_jcs_float(value)
+    raise TypeError('Object of type {} is not JSON serializable'.format(value_type.__name__))
+
+
+def _iter_canonical_json_chunks(data: JsonType,
+                                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    """
+    Yield the RFC 8785 text of data in chunks of roughly chunk_size characters.
+    Like _iter_canonical_chunks(), the traversal uses an explicit stack so there
+    is no limit on depth.
+    """
+    pieces = []
+    append = pieces.append
+    size = 0
+    # per open container: (iterator of keys and their prefix, dict) or (iterator of items, None)
+    stack = []
+    opened = []  # the dicts and lists of stack, for _check_no_cycle()
+    next_cycle_check = _CYCLE_CHECK_DEPTH
+    sort_keys = _jcs_key_orders.get_sorter()
+    ndarray = _get_ndarray_type()
+    value = data
+    prefix = ''
+    while True:
+        value_type = type(value)
+        if value_type is dict:
+            if value:
+                keys = zip(*sort_keys(value))
+                key, key_prefix = next(keys)
+                append(prefix + key_prefix)
+                size += len(prefix) + len(key_prefix)
+                stack.append((keys, value))
+                opened.append(value)
+                if len(opened) >= next_cycle_check:
+                    next_cycle_check = _check_no_cycle(opened)
+                value = value[key]
+                prefix = ''
+                continue
+            append(prefix + '{}')
+            size += len(prefix) + 2
+
+        elif value_type is list or value_type is tuple:
+            if value:
+                items = iter(value)
+                append(prefix + '[')
+                size += len(prefix) + 1
+                stack.append((items, None))
+                opened.append(value)
+                if len(opened) >= next_cycle_check:
+                    next_cycle_check = _check_no_cycle(opened)
+                value = next(items)
+                prefix = ''
+                continue
+            append(prefix + '[]')
+            size += len(prefix) + 2
+
+        elif value_type is ndarray:
+            value = value.tolist()
+            continue
+
+        else:
+            if value_type is str:
+                text = encode_basestring(value)
+            elif value_type is int:
+                text = int.__repr__(value)
+            elif isinstance(value, ndarray):  # a subclass, eg numpy.memmap
+                value = value.tolist()
+                continue
+            else:
+                text = _get_jcs_scalar(value)
+            if prefix:
+                append(prefix)
+            append(text)
+            size += len(prefix) + len(text)
+
+        # value is done, move to the next one
+        while stack:
+            if size >= chunk_size:
+                yield ''.join(pieces)
+                pieces.clear()
+                size = 0
+            items, container = stack[-1]
+            item = next(items, _END)
+            if item is _END:
+                stack.pop()
+                opened.pop()
+                append(']' if container is None else '}')
+                size += 1
+                continue
+            if container is None:
+                prefix = ','
+                value = item
+            else:
+                key, prefix = item
+                value = container[key]
+            break
+        else:
+            break
+
+    if pieces:
+        yield ''.join(pieces)
+
+
+def iter_canonical_json(data: JsonType, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield the canonical JSON of data as UTF-8 bytes, in chunks of roughly
+    chunk_size characters. The format follows RFC 8785 (JSON Canonicalization
+    Scheme): no whitespace, keys sorted by UTF-16 code units, strings with only
+    the required escapes, and floats as the shortest text that reads back as the
+    same float (so 1.0 is written as 1). Unlike RFC 8785, ints are written
+    exactly even beyond 2 ** 53.
+
+    These are the bytes hashed by get_json_sem_hash() with encoding='jcs', so
+    they can be stored or sent (see write_canonical_json()), read back with
+    json.loads(), and give the same hash again. Data can contain dicts with str
+    keys, lists, tuples, str, int, float, bool, None and numpy arrays; other
+    values raise TypeError, and NaN and infinities raise ValueError.
+    """
+    for chunk in _iter_canonical_json_chunks(data, chunk_size):
+        yield chunk.encode('UTF-8')
+
+
+def write_canonical_json(data: JsonType, stream, hashers: Sequence = (),
+                         chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[str]:
+    """
+    Write the canonical JSON of data (see iter_canonical_json()) to stream,
+    a binary file or a socket, in chunks of roughly chunk_size characters, and
+    give each chunk to the given hashers too (hashlib-style constructors or
+    algorithm names, see get_hasher()), so that a document can be stored or
+    sent and hashed in a single pass. Returns the hex digest of each hasher,
+    the same as get_json_sem_hash(data, hasher, encoding='jcs').
+    """
+    write = stream.sendall if hasattr(stream, 'sendall') else stream.write
+    hash_objs = [(get_hasher(hasher) if isinstance(hasher, str) else hasher)()
+                 for hasher in hashers]
+    updates = [hash_obj.update for hash_obj in hash_objs]
+    for chunk in iter_canonical_json(data, chunk_size):
+        write(chunk)
+        for update in updates:
+            update(chunk)
+    return [hash_obj.hexdigest() for hash_obj in hash_objs]
+
+
+# tokens of the tagged encoding: a tag byte, then for some a little-endian payload
+_TAGGED_INT = Struct('<cq')  # b'i', int64
+_TAGGED_FLOAT = Struct('<cd')  # b'f', IEEE-754 float64
+# b's' and UTF-8 length, b'I' and byte length of a larger int (two's complement), b'['
+# and number of items, b'{' and number of keys, b'q' or b'd' and number of packed numbers
+_TAGGED_SIZE = Struct('<cI')
+_TAGGED_CONSTANTS = {'None': b'N', 'True': b'T', 'False': b'F'}
+
+
+def _get_tagged_int(value: int) -> bytes:
+    try:
+        return _TAGGED_INT.pack(b'i', value)
+    except struct.error:
+        data = value.to_bytes(value.bit_length() // 8 + 1, 'little', signed=True)
+        return _TAGGED_SIZE.pack(b'I', len(data)) + data
+
+
+def _get_tagged_scalar(value) -> bytes:
+    """Get the tagged encoding of a value that is not a container"""
+    value_type = type(value)
+    if value_type is str:
+        data = value.encode('UTF-8', 'surrogatepass')
+        return _TAGGED_SIZE.pack(b's', len(data)) + data
+    if value_type is int:
+        return _get_tagged_int(value)
+    if value_type is float:
+        return _TAGGED_FLOAT.pack(b'f', value)
+    if value is None or value is True or value is False:
+        return _TAGGED_CONSTANTS[str(value)]
+    if isinstance(value, str):
+        return _get_tagged_scalar(str.__str__(value))
+    if isinstance(value, int):
+        return _get_tagged_int(int(value))
+    if isinstance(value, float):
+        return _TAGGED_FLOAT.pack(b'f', value)
+    raise TypeError('Object of type {} cannot be tagged'.format(value_type.__name__))
+
+
+def _sort_tagged_keys(keys: Iterable) -> Tuple[List, List[bytes]]:
+    """
+    Get the sorted keys of a dict and the tagged encoding that precedes the
+    value of each key: the dict's tag and number of keys, then the key, for
+    the first key; only the key for the others.
+    """
+    sorted_keys = sorted(keys)
+    try:
+        encoded_keys = [key.encode('UTF-8', 'surrogatepass') for key in sorted_keys]
+        prefixes = [_TAGGED_SIZE.pack(b's', len(key)) + key for key in encoded_keys]
+    except AttributeError:  # not all str
+        prefixes = [_get_tagged_scalar(key) for key in sorted_keys]
+    prefixes[0] = _TAGGED_SIZE.pack(b'{', len(sorted_keys)) + prefixes[0]
+    return sorted_keys, prefixes
+
+
+_tagged_key_orders = _KeyOrderCache(_sort_tagged_keys)
+
+
+def _pack_tagged_numbers(data: list) -> Optional[array]:
+    """
+    Get data packed as in _pack_numbers() if all its items are ints that fit
+    in 64 bits, or all floats; else None.
+    """
+    number_type = type(data[0])
+    if number_type not in _NUMBER_TYPES or len(set(map(type, data))) != 1:
+        return None
+    return _pack_numbers(data, number_type)
+
+
+def _iter_tagged_chunks(data: JsonType,
+                        chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Union[bytes, memoryview]]:
+    """
+    Yield the tagged encoding of data in chunks of roughly chunk_size bytes.
+    Each value is a type tag byte followed by a fixed-size or size-prefixed
+    payload, so no str is made per value and the encoding of different values
+    never collide (eg 1, '1', 1.0 and True). Dicts are their number of keys
+    followed by key and value pairs by sorted key, lists their number of items
+    followed by the items, except that non-empty lists of only ints that fit
+    in 64 bits, or only floats, are packed arrays of int64 or float64 (as are
+    the equivalent 1-dimensional numpy arrays, without conversion to lists).
+    Like _iter_canonical_chunks(), the traversal uses an explicit stack, and
+    the UTF-8 of strings of LARGE_LEAF_SIZE bytes or more is yielded as
+    memoryview chunks rather than copied into the chunks.
+    """
+    buf = bytearray()
+    extend = buf.extend
+    pack_int = _TAGGED_INT.pack
+    pack_size = _TAGGED_SIZE.pack
+    # per open container: (iterator of keys and their prefix, dict) or (iterator of items, None)
+    stack = []
+    opened = []  # the dicts and lists of stack, for _check_no_cycle()
+    next_cycle_check = _CYCLE_CHECK_DEPTH
+    sort_keys = _tagged_key_orders.get_sorter()
+    ndarray = _get_ndarray_type()
+    value = data
+    while True:
+        value_type = type(value)
+        if value_type is dict:
+            if value:
+                keys = zip(*sort_keys(value))
+                key, key_prefix = next(keys)
+                extend(key_prefix)
+                stack.append((keys, value))
+                opened.append(value)
+                if len(opened) >= next_cycle_check:
+                    next_cycle_check = _check_no_cycle(opened)
+                value = value[key]
+                continue
+            extend(_TAGGED_SIZE.pack(b'{', 0))
+
+        elif value_type is list or value_type is tuple:
+            # (quick checks first, since most lists are not numbers)
+            packed = (_pack_tagged_numbers(value) if value and type(value[0]) in _NUMBER_TYPES
+                      and type(value[-1]) is type(value[0]) else None)
+            if packed is not None:
+                extend(_TAGGED_SIZE.pack(packed.typecode.encode(), len(value)))
+                extend(packed)
+            elif value:
+                items = iter(value)
+                extend(_TAGGED_SIZE.pack(b'[', len(value)))
+                stack.append((items, None))
+                opened.append(value)
+                if len(opened) >= next_cycle_check:
+                    next_cycle_check = _check_no_cycle(opened)
+                value = next(items)
+                continue
+            else:
+                extend(_TAGGED_SIZE.pack(b'[', 0))
+
+        elif value_type is ndarray:
+            type_code = _get_ndarray_type_code(value, min_len=1)
+            if type_code is None:
+                value = value.tolist()
+                continue
+            packed = value.astype('<f8' if type_code == 'd' else '<i8', order='C', copy=False)
+            extend(_TAGGED_SIZE.pack(type_code.encode(), len(value)))
+            extend(memoryview(packed).cast('B'))
+
+        elif value_type is str:
+            value = value.encode('UTF-8', 'surrogatepass')
+            extend(pack_size(b's', len(value)))
+            if len(value) >= LARGE_LEAF_SIZE:
+                yield bytes(buf)
+                buf.clear()
+                yield from _iter_buffer_chunks(value)
+            else:
+                extend(value)
+        elif value_type is int and -0x8000000000000000 <= value <= 0x7fffffffffffffff:
+            extend(pack_int(b'i', value))
+        elif isinstance(value, ndarray):  # a subclass, eg numpy.memmap
+            value = _get_base_ndarray(value)
+            continue
+        else:
+            extend(_get_tagged_scalar(value))
+
+        if len(buf) >= chunk_size:
+            yield bytes(buf)
+            buf.clear()
+
+        # value is done, move to the next one
+        while stack:
+            items, container = stack[-1]
+            item = next(items, _END)
+            if item is _END:
+                stack.pop()
+                opened.pop()
+                continue
+            if container is None:
+                value = item
+            else:
+                key, key_prefix = item
+                extend(key_prefix)
+                value = container[key]
+            break
+        else:
+            break
+
+    if buf:
+        yield bytes(buf)
+
+
+def iter_canonical_bytes(data: JsonType, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         unordered: Union[bool, Iterable[PathPattern]] = None,
+                         hasher=hashlib.sha256, memo: bool = False,
+                         columnar: bool = False, packed_numbers: bool = False,
+                         encoding: str = 'repr', include: Iterable[PathPattern] = None,
+                         exclude: Iterable[PathPattern] = None
+                         ) -> Iterator[Union[bytes, memoryview]]:
+    """
+    Yield the canonical UTF-8 bytes of data (the bytes that get hashed by
+    get_json_sem_hash()) as chunks of roughly chunk_size characters. A leaf
+    larger than chunk_size is yielded as a single chunk, except str and bytes
+    leaves of LARGE_LEAF_SIZE or more, which are yielded, when their canonical
+    bytes are the same as their own (eg base64 text), as memoryview chunks of
+    LARGE_LEAF_SIZE bytes of the leaf (or of its UTF-8 encoding), without
+    copying them into the canonical text. See get_json_sem_hash()
+    for unordered, memo, columnar, packed_numbers, encoding, include and
+    exclude; hasher (a hashlib-style constructor or algorithm name, see
+    get_hasher()) is only used for the items of unordered lists, the columns of
+    record lists and packed numbers.
+    """
+    if isinstance(hasher, str):
+        hasher = get_hasher(hasher)
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown encoding {!r}, must be one of {}'.format(encoding, ENCODINGS))
+    if encoding != 'repr':
+        if unordered or memo or columnar or packed_numbers or include or exclude:
+            raise ValueError('unordered, memo, columnar, packed_numbers, include and exclude '
+                             'require the repr encoding')
+        if encoding == 'jcs':
+            yield from iter_canonical_json(data, chunk_size)
+        else:
+            yield from _iter_tagged_chunks(data, chunk_size)
+        return
+
+    if columnar and (unordered or include or exclude):
+        raise ValueError('columnar cannot be combined with unordered lists or path patterns')
+    if (unordered and unordered is not True) or include or exclude:
+        unordered = _get_path_matcher(('**',) if unordered is True else unordered or (),
+                                      include or (), exclude or ())
+    for chunk in _iter_canonical_chunks(data, chunk_size, unordered or None, hasher, memo,
+                                        columnar, packed_numbers, large_leaves=True):
+        yield chunk.encode('UTF-8') if type(chunk) is str else chunk
+
+
+def update_json_sem_hash(hash_obj, data: JsonType, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                         unordered: Union[bool, Iterable[PathPattern]] = None,
+                         hasher=hashlib.sha256, memo: bool = False, columnar: bool = False,
+                         packed_numbers: bool = False, encoding: str = 'repr',
+                         include: Iterable[PathPattern] = None,
+                         exclude: Iterable[PathPattern] = None):
+    """
+    Feed the canonical bytes of data into hash_obj (any object with an
+    update(bytes) method, such as those returned by hashlib constructors)
+    in chunks, so that peak memory stays close to the size of data. See
+    get_json_sem_hash() for unordered, memo, columnar, packed_numbers,
+    encoding, include and exclude; hasher (a hashlib-style constructor or
+    algorithm name, see get_hasher()) is only used for the items of unordered
+    lists, the columns of record lists and packed numbers.
+    """
+    update = hash_obj.update
+    for chunk in iter_canonical_bytes(data, chunk_size, unordered, hasher, memo, columnar,
+                                      packed_numbers, encoding, include, exclude):
+        update(chunk)
+
+
+def get_json_sem_hash(data: JsonTree, hasher=hashlib.sha256,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      unordered: Union[bool, Iterable[PathPattern]] = None,
+                      memo: bool = False, columnar: bool = False,
+                      packed_numbers: bool = False, encoding: str = 'repr',
+                      include: Iterable[PathPattern] = None,
+                      exclude: Iterable[PathPattern] = None) -> str:
+    """
+    Get the hex digest of the semantic hash of data, computed with the given
+    hashlib-style constructor or algorithm name (see get_hasher()). The document
+    is walked once and its canonical bytes are streamed to the hasher in chunks
+    of roughly chunk_size characters; the digest is the same as
+    hasher(bytes(repr(sorted_dict_str(data)), 'UTF-8')). A circular reference
+    (a dict or list that contains itself) raises ValueError.
+
+    The unordered argument gives the lists for which order does not matter (eg
+    lists of tags): True for all lists, or path patterns like 'metadata.tags'
+    or 'spec.containers.*.env' ('*' matches any key or list index, '**' any
+    number of them, so eg '**.tags' matches tags keys at any depth). Such lists
+    are hashed as multisets, in linear time, so eg [1, 2, 2] and [2, 1, 2] have
+    the same hash but [1, 2] does not.
+
+    The include and exclude arguments give path patterns (as for unordered) of
+    the values to hash, eg exclude=['metadata.generation', '*.timestamp',
+    'status'] to ignore volatile fields of Kubernetes objects: values that match
+    exclude are left out, along with their key or list item, and if include is
+    given, only the values that match it, and the dicts and lists that lead to
+    them, are hashed. Values that are left out are not walked. The patterns are
+    compiled once into a matcher that follows the walk (see _PathMatcher), and
+    the matcher is reused by later calls with the same patterns.
+
+    If memo is True, dicts and lists that are referenced from several places
+    in data (the same object, as opposed to equal objects) are walked only
+    once: the text of the first occurrence is reused for the others. This
+    speeds up documents built in Python with shared blocks (eg defaults),
+    at the cost of a first pass over the unique nodes of data to find them,
+    and of memory for the text of shared blocks. Ignored if path patterns
+    are given (unordered, include or exclude).
+
+    If columnar is True, lists of 2 or more records (dicts that all have the
+    same keys) are hashed column by column: the values of each key are hashed
+    together, ints and floats as packed arrays rather than one str() per value.
+    This gives different hash values than columnar=False (but equivalent
+    record lists still get the same hash), and is much faster for large tables.
+    It cannot be combined with unordered lists or path patterns, since the
+    columns are hashed in record order.
+
+    If packed_numbers is True, lists of MIN_NUMBERS_LIST_LEN or more ints (that
+    fit in 64 bits) or floats are hashed as packed arrays of int64 or float64,
+    without converting each number to str. This also gives different hash
+    values than packed_numbers=False.
+
+    Numpy arrays can be used as values in data: they get the same hash as the
+    equivalent lists. With packed_numbers=True, the buffer of a 1-dimensional
+    numpy array of numbers is hashed directly (after conversion to int64 or
+    float64 if needed).
+
+    If encoding is 'jcs', the canonical bytes are the canonical JSON of data
+    instead (see iter_canonical_json()), which other tools can produce and
+    hash too, and which can be stored as it was hashed (see
+    write_canonical_json()). This gives different hash values than the default
+    'repr' encoding; also, ints and floats that are equal (1 and 1.0) then get
+    the same hash, as in JSON.
+
+    If encoding is 'tagged', the canonical bytes are a binary encoding where
+    each value has a type tag, and numbers and strings are hashed without
+    conversion to text: ints as int64, floats as IEEE-754 float64, strings as
+    length-prefixed UTF-8, lists of only ints or only floats as packed arrays.
+    In the 'repr' encoding all values are hashed as their str(), so eg 1, '1'
+    and True in place of 'True' give the same hash; in the 'tagged' encoding
+    they do not. This also gives different hash values than 'repr', and is
+    faster for documents with many numbers.
+
+    The encoding is part of what is hashed, so the same one must be used to
+    get reproducible hashes; 'repr' is the original one. The 'jcs' and 'tagged'
+    encodings cannot be combined with the other options.
+    """
+    if isinstance(hasher, str):
+        hasher = get_hasher(hasher)
+    hash_obj = hasher()
+    update_json_sem_hash(hash_obj, data, chunk_size, unordered, hasher, memo, columnar,
+                         packed_numbers, encoding, include, exclude)
+    return hash_obj.hexdigest()
+
+
+def get_json_sem_multi_hash(data: JsonType, hashers: Sequence,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE, memo: bool = False,
+                            encoding: str = 'repr') -> List[str]:
+    """
+    Get the hex digests of data for several hashers (hashlib-style constructors
+    or algorithm names, see get_hasher()) from a single walk of data: each chunk
+    of canonical bytes is given to all of them. Eg
+    `md5_hash, sha256_hash = get_json_sem_multi_hash(values, ['md5', 'sha256'])`
+    gives the same as get_json_sem_hash(values, 'md5') and get_json_sem_hash(values)
+    in about the time of one. See get_json_sem_hash() for chunk_size, memo and encoding; the
+    options that embed digests in the canonical bytes (unordered, columnar,
+    packed_numbers) are not available since those bytes would then differ per hasher.
+    """
+    hash_objs = [(get_hasher(hasher) if isinstance(hasher, str) else hasher)()
+                 for hasher in hashers]
+    updates = [hash_obj.update for hash_obj in hash_objs]
+    for chunk in iter_canonical_bytes(data, chunk_size, memo=memo, encoding=encoding):
+        for update in updates:
+            update(chunk)
+    return [hash_obj.hexdigest() for hash_obj in hash_objs]
+
+
+_STR_KEYS = {str}
+
+
+def json_sem_equal(a: JsonType, b: JsonType) -> bool:
+    """
+    True if a and b are semantically equivalent, ie have the same hash with
+    get_json_sem_hash() and its default options, but without hashing: the two
+    structures are walked together and the walk stops at the first difference.
+    Dicts that differ in length or keys are not equal, without sorting keys or
+    converting values to str; the same object found at the same place in a
+    and b is not walked. Like get_json_sem_hash(), the walk uses an explicit
+    stack so there is no limit on depth.
+    """
+    # pairs to compare, and _END below the items of each dict or list of a, to pop it from opened
+    stack = [(a, b)]
+    pop = stack.pop
+    opened = []  # the open dicts and lists of a, for _check_no_cycle()
+    next_cycle_check = _CYCLE_CHECK_DEPTH
+    ndarray = _get_ndarray_type()
+    while stack:
+        item = pop()
+        if item is _END:
+            opened.pop()
+            continue
+        a, b = item
+        if a is b:
+            continue
+        type_a, type_b = type(a), type(b)
+        if isinstance(a, ndarray):
+            a = a.tolist()
+            type_a = type(a)
+        if isinstance(b, ndarray):
+            b = b.tolist()
+            type_b = type(b)
+
+        if type_a is dict:
+            if type_b is not dict or len(a) != len(b) or a.keys() != b.keys():
+                return False
+            # equal keys can still have different text, eg 1 and True
+            if set(map(type, a)) != _STR_KEYS and (
+                    list(map(repr, sorted(a))) != list(map(repr, sorted(b)))):
+                return False
+            stack.append(_END)
+            opened.append(a)
+            if len(opened) >= next_cycle_check:
+                next_cycle_check = _check_no_cycle(opened)
+            stack.extend((a[key], b[key]) for key in a)
+        elif type_a is list:
+            if type_b is not list or len(a) != len(b):
+                return False
+            stack.append(_END)
+            opened.append(a)
+            if len(opened) >= next_cycle_check:
+                next_cycle_check = _check_no_cycle(opened)
+            stack.extend(zip(a, b))
+        elif type_b is dict or type_b is list:
+            return False
+        elif type_a is type_b and (type_a is str or type_a is int):
+            if a != b:
+                return False
+        elif str(a) != str(b):
+            return False
+    return True
+
+
+def iter_json_sem_hashes(docs: Iterable[JsonType], hasher=hashlib.sha256,
+                         workers: Optional[int] = None,
+                         chunksize: int = DEFAULT_DOCS_PER_TASK) -> Iterator[str]:
+    """
+    Yield get_json_sem_hash(doc, hasher) for each doc of docs, in the same order
+    as docs, computed by a pool of worker processes:
+
+    - workers: number of processes; if None, the number of CPUs; if 1, the hashes
+      are computed in the current process (no pickling of docs)
+    - chunksize: number of docs sent to a worker at a time; larger values
+      decrease inter-process overhead when docs are small
+
+    Note that the hasher must be picklable (hashlib constructors and algorithm
+    names are). The pool is shut down when the generator is exhausted or closed.
+    """
+    yield from _imap(partial(get_json_sem_hash, hasher=hasher), docs, workers, chunksize)
+
+
+def _imap(func: Callable, items: Iterable, workers: Optional[int], chunksize: int) -> Iterator:
+    """Yield func(item) for each item, in order, computed by a pool of workers processes"""
+    if workers == 1:
+        yield from map(func, items)
+        return
+
+    with Pool(workers) as pool:
+        yield from pool.imap(func, items, chunksize)
+
+
+def get_json_sem_hashes(docs: Iterable[JsonType], hasher=hashlib.sha256,
+                        workers: Optional[int] = None,
+                        chunksize: int = DEFAULT_DOCS_PER_TASK) -> List[str]:
+    """
+    Get the list of semantic hashes of docs, in the same order as docs. See
+    iter_json_sem_hashes() for a description of the parameters.
+    """
+    return list(iter_json_sem_hashes(docs, hasher, workers, chunksize))
+
+
+class JsonSemNode:
+    """
+    Semantic digest of one node of a JSON tree, as computed by get_json_sem_merkle():
+
+    - digest: raw digest bytes of the node
+    - children: dict of key -> JsonSemNode for a JSON object, list of JsonSemNode
+      for a JSON array, None for a leaf
+
+    The digest of an object or array is computed only from its keys and the
+    digests of its children, so two nodes with equal digests are semantically
+    equal subtrees (barring hash collisions).
+    """
+    __slots__ = ('digest', 'children')
+
+    def __init__(self, digest: bytes,
+                 children: Union[Dict[str, 'JsonSemNode'], List['JsonSemNode'], None] = None):
+        self.digest = digest
+        self.children = children
+
+    def hexdigest(self) -> str:
+        return self.digest.hex()
+
+    def __repr__(self):
+        return 'JsonSemNode({})'.format(self.hexdigest())
+
+
+def _combined_digest(children: Union[Dict[str, JsonSemNode], List[JsonSemNode]],
+                     hasher) -> bytes:
+    if type(children) == dict:
+        hash_obj = hasher(b'{')
+        for key in sorted(children.keys()):
+            hash_obj.update(bytes(repr(key), 'UTF-8') + b':' + children[key].digest)
+        hash_obj.update(b'}')
+    else:
+        hash_obj = hasher(b'[')
+        for child in children:
+            hash_obj.update(child.digest)
+        hash_obj.update(b']')
+    return hash_obj.digest()
+
+
+def combine_json_sem_nodes(
+        children: Union[Dict[str, JsonSemNode], List[JsonSemNode]],
+        hasher=hashlib.sha256) -> JsonSemNode:
+    """
+    Create the node of a JSON object (if children is a dict) or array (if children
+    is a list) from the nodes of its children. This allows subtrees to be hashed
+    separately (cached, or computed in other processes) and assembled afterwards.
+    The hasher is a hashlib-style constructor or algorithm name (see get_hasher()).
+    """
+    if isinstance(hasher, str):
+        hasher = get_hasher(hasher)
+    return JsonSemNode(_combined_digest(children, hasher), children)
+
+
+def get_json_sem_merkle(data: JsonType, hasher=hashlib.sha256,
+                        memo: bool = False) -> Tuple[str, JsonSemNode]:
+    """
+    Compute a digest for every object, array and leaf of data, each parent's
+    digest being computed from its children's digests (a Merkle tree). Returns
+    a pair: the hex digest of the root, and the root JsonSemNode.
+
+    The hasher is a hashlib-style constructor or algorithm name (see get_hasher()).
+    Note: the root digest is not the same value as get_json_sem_hash(data),
+    although it has the same semantic equivalence rules.
+
+    If memo is True, a dict or list referenced from several places in data (the
+    same object) is hashed only once, so the cost is proportional to the number
+    of unique nodes of data. Its node is then shared by several parents in the
+    returned tree, so such a tree must not be given to rehash_json_patch().
+
+    A circular reference (a dict or list that contains itself) raises ValueError.
+    """
+    if isinstance(hasher, str):
+        hasher = get_hasher(hasher)
+    root = _get_merkle_node(data, hasher, memo)
+    return root.hexdigest(), root
+
+
+def _get_merkle_node(data: JsonType, hasher, memo: bool = False) -> JsonSemNode:
+    # explicit stack (no depth limit); per open container: [items iterator, children, key, id]
+    stack = []
+    nodes = {} if memo else None  # id of container -> its node
+    next_cycle_check = _CYCLE_CHECK_DEPTH
+    ndarray = _get_ndarray_type()
+    value = data
+    while True:
+        value_type = type(value)
+        if isinstance(value, ndarray):
+            value = value.tolist()
+            value_type = type(value)
+        if memo and (value_type is dict or value_type is list) and id(value) in nodes:
+            node = nodes[id(value)]
+            if node is None:
+                raise ValueError('Circular reference in JSON data')
+        elif value_type is dict:
+            stack.append([iter(value.items()), {}, None, id(value)])
+            if memo:
+                nodes[id(value)] = None
+            node = None
+        elif value_type is list:
+            stack.append([iter(value), [], None, id(value)])
+            if memo:
+                nodes[id(value)] = None
+            node = None
+        else:
+            node = JsonSemNode(hasher(bytes(repr(str(value)), 'UTF-8')).digest())
+        if len(stack) >= next_cycle_check:
+            if len({frame[3] for frame in stack}) < len(stack):
+                raise ValueError('Circular reference in JSON data')
+            next_cycle_check = 2 * len(stack)
+
+        while stack:
+            frame = stack[-1]
+            items, children, key, container_id = frame
+            if node is not None:
+                if type(children) is list:
+                    children.append(node)
+                else:
+                    children[key] = node
+            item = next(items, _END)
+            if item is _END:
+                stack.pop()
+                node = JsonSemNode(_combined_digest(children, hasher), children)
+                if memo:
+                    nodes[container_id] = node
+            else:
+                if type(children) is dict:
+                    frame[2], value = item
+                else:
+                    value = item
+                break
+        else:
+            return node
+
+
+def _escape_json_pointer_token(key) -> str:
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def json_sem_diff(a: Union[JsonType, JsonSemNode], b: Union[JsonType, JsonSemNode],
+                  hasher=hashlib.sha256) -> List[str]:
+    """
+    Get the JSON pointers (RFC 6901, eg '/spec/containers/0/image') of the
+    nodes that differ semantically between a and b. Subtrees that have the same
+    digest are not visited. A key or index that exists on only one side is
+    reported at that key or index. If a and b are equal, the list is empty; if
+    they differ at the root (eg different types), the list is [''].
+
+    Either argument can be a JsonSemNode from get_json_sem_merkle(), computed
+    with the same hasher, to avoid re-hashing a document that is compared often.
+    The hasher is a hashlib-style constructor or algorithm name (see get_hasher()).
+    """
+    if isinstance(hasher, str):
+        hasher = get_hasher(hasher)
+    node_a = a if isinstance(a, JsonSemNode) else _get_merkle_node(a, hasher)
+    node_b = b if isinstance(b, JsonSemNode) else _get_merkle_node(b, hasher)
+    return _diff_nodes(node_a, node_b)
+
+
+def _diff_nodes(node_a: JsonSemNode, node_b: JsonSemNode) -> List[str]:
+    diffs = []
+    # explicit stack (no depth limit); a None node means the path exists on one side only
+    stack = [(node_a, node_b, '')]
+    while stack:
+        node_a, node_b, path = stack.pop()
+        if node_a is None or node_b is None:
+            diffs.append(path)
+            continue
+        if node_a.digest == node_b.digest:
+            continue
+
+        children_a, children_b = node_a.children, node_b.children
+        if type(children_a) == dict and type(children_b) == dict:
+            pending = [(children_a.get(key), children_b.get(key),
+                        path + '/' + _escape_json_pointer_token(key))
+                       for key in sorted(children_a.keys() | children_b.keys())]
+        elif type(children_a) == list and type(children_b) == list:
+            len_a, len_b = len(children_a), len(children_b)
+            pending = [(children_a[index] if index < len_a else None,
+                        children_b[index] if index < len_b else None,
+                        path + '/' + str(index))
+                       for index in range(max(len_a, len_b))]
+        else:
+            diffs.append(path)
+            continue
+        stack.extend(reversed(pending))
+
+    return diffs
+
+
+def _parse_json_pointer(pointer: str) -> List[str]:
+    if pointer == '':
+        return []
+    if not pointer.startswith('/'):
+        raise ValueError('Invalid JSON pointer "{}"'.format(pointer))
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def _copy_node(node: JsonSemNode) -> JsonSemNode:
+    root = JsonSemNode(node.digest)
+    stack = [(node, root)]
+    while stack:
+        node, copy = stack.pop()
+        if type(node.children) == dict:
+            copy.children = {key: JsonSemNode(child.digest) for key, child in node.children.items()}
+            stack.extend((child, copy.children[key]) for key, child in node.children.items())
+        elif type(node.children) == list:
+            copy.children = [JsonSemNode(child.digest) for child in node.children]
+            stack.extend(zip(node.children, copy.children))
+    return root
+
+
+class _MerklePatcher:
+    """
+    Applies JSON Patch operations to a JsonSemNode tree. The nodes on the path
+    to each modified node are marked dirty, and their digests are recomputed,
+    deepest first and only once each, when flush() is called.
+    """
+
+    def __init__(self, root: JsonSemNode, hasher):
+        self.root = root
+        self.hasher = hasher
+        self._dirty = {}
+
+    def _walk(self, tokens: List[str], pointer: str, mark_dirty: bool) -> JsonSemNode:
+        """Get the node at tokens; all nodes traversed are marked dirty if mark_dirty"""
+        node = self.root
+        for depth, token in enumerate(tokens):
+            if mark_dirty:
+                self._dirty[id(node)] = (depth, node)
+            if type(node.children) == dict and token in node.children:
+                node = node.children[token]
+            elif type(node.children) == list and token.isdigit() and int(token) < len(node.children):
+                node = node.children[int(token)]
+            else:
+                raise ValueError('JSON pointer "{}" does not exist'.format(pointer))
+        return node
+
+    def _list_index(self, children: list, token: str, pointer: str, adding: bool) -> int:
+        if adding and token == '-':
+            return len(children)
+        max_index = len(children) if adding else len(children) - 1
+        if not token.isdigit() or int(token) > max_index:
+            raise ValueError('Invalid array index in JSON pointer "{}"'.format(pointer))
+        return int(token)
+
+    def get(self, pointer: str) -> JsonSemNode:
+        return self._walk(_parse_json_pointer(pointer), pointer, False)
+
+    def add(self, pointer: str, node: JsonSemNode, replace: bool = False):
+        tokens = _parse_json_pointer(pointer)
+        if not tokens:
+            self.root = node
+            self._dirty.clear()
+            return
+
+        parent = self._walk(tokens[:-1], pointer, True)
+        self._dirty[id(parent)] = (len(tokens) - 1, parent)
+        token = tokens[-1]
+        if type(parent.children) == dict:
+            if replace and token not in parent.children:
+                raise ValueError('JSON pointer "{}" does not exist'.format(pointer))
+            parent.children[token] = node
+        elif type(parent.children) == list:
+            index = self._list_index(parent.children, token, pointer, not replace)
+            if replace:
+                parent.children[index] = node
+            else:
+                parent.children.insert(index, node)
+        else:
+            raise ValueError('JSON pointer "{}" is not in an object or array'.format(pointer))
+
+    def remove(self, pointer: str) -> JsonSemNode:
+        tokens = _parse_json_pointer(pointer)
+        if not tokens:
+            raise ValueError('Cannot remove the root of the document')
+
+        parent = self._walk(tokens[:-1], pointer, True)
+        self._dirty[id(parent)] = (len(tokens) - 1, parent)
+        token = tokens[-1]
+        if type(parent.children) == dict and token in parent.children:
+            return parent.children.pop(token)
+        elif type(parent.children) == list:
+            return parent.children.pop(self._list_index(parent.children, token, pointer, False))
+        else:
+            raise ValueError('JSON pointer "{}" does not exist'.format(pointer))
+
+    def flush(self):
+        for _, node in sorted(self._dirty.values(), key=lambda item: item[0], reverse=True):
+            node.digest = _combined_digest(node.children, self.hasher)
+        self._dirty.clear()
+
+
+def rehash_json_patch(root: JsonSemNode, patch: List[dict],
+                      hasher=hashlib.sha256) -> Tuple[str, JsonSemNode]:
+    """
+    Update a JsonSemNode tree, obtained from get_json_sem_merkle() with the same
+    hasher, to reflect the RFC 6902 JSON Patch operations in patch (a list of
+    dicts like {'op': 'replace', 'path': '/a/0', 'value': 3}). Only the values
+    given in the operations are hashed, and only the ancestors of the modified
+    nodes get their digest recomputed (once each, regardless of the number of
+    operations that touched them).
+
+    The tree is modified in place. Returns a pair: the hex digest of the new
+    root, and the new root node (a different object than root only if the
+    patch replaced the whole document). A failed 'test' operation or an invalid
+    path raises ValueError; the tree is then in an undefined state. The hasher
+    is a hashlib-style constructor or algorithm name (see get_hasher()).
+    """
+    if isinstance(hasher, str):
+        hasher = get_hasher(hasher)
+    patcher = _MerklePatcher(root, hasher)
+    for operation in patch:
+        op, path = operation['op'], operation['path']
+        if op == 'add':
+            patcher.add(path, _get_merkle_node(operation['value'], hasher))
+        elif op == 'replace':
+            patcher.add(path, _get_merkle_node(operation['value'], hasher), replace=True)
+        elif op == 'remove':
+            patcher.remove(path)
+        elif op == 'move':
+            # the digests of the moved subtree must be final (dirty nodes are recombined by
+            # depth, which changes with the move)
+            patcher.flush()
+            patcher.add(path, patcher.remove(operation['from']))
+        elif op == 'copy':
+            patcher.flush()
+            patcher.add(path, _copy_node(patcher.get(operation['from'])))
+        elif op == 'test':
+            patcher.flush()
+            if patcher.get(path).digest != _get_merkle_node(operation['value'], hasher).digest:
+                raise ValueError('JSON patch test failed at "{}"'.format(path))
+        else:
+            raise ValueError('Unsupported JSON patch operation "{}"'.format(op))
+
+    patcher.flush()
+    return patcher.root.hexdigest(), patcher.root
+
+
+# states of the incremental JSON parser
+_EXPECT_VALUE = 0
+_EXPECT_VALUE_OR_END = 1  # just after [
+_EXPECT_KEY = 2
+_EXPECT_KEY_OR_END = 3  # just after {
+_EXPECT_COLON = 4
+_AFTER_VALUE = 5
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = re.compile(r'-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?')
+# what may follow a _NUMBER match at the end of the buffer when the number continues
+_NUMBER_CUT = re.compile(r'(?:\.|[eE][-+]?)?')
+_CONSTANTS = (('true', True), ('false', False), ('null', None),
+              ('NaN', float('nan')), ('Infinity', float('inf')), ('-Infinity', float('-inf')))
+_MAX_CONSTANT_LEN = 9
+_ITEM_END = re.compile(r'[ \t\n\r]*([,\]])')  # what follows an item of an array
+_json_decoder = JSONDecoder()
+
+
+def _find_string_end(buf: str, start: int) -> int:
+    """Get index of first unescaped double-quote in buf at or after start, or -1"""
+    index = buf.find('"', start)
+    while index != -1:
+        num_backslashes = 0
+        while buf[index - 1 - num_backslashes] == '\\':
+            num_backslashes += 1
+        if num_backslashes % 2 == 0:
+            return index
+        index = buf.find('"', index + 1)
+    return -1
+
+
+def iter_json_events(read: Callable[[int], str], read_size: int = DEFAULT_CHUNK_SIZE,
+                     small_containers: bool = False) -> Iterator[Tuple[str, object]]:
+    """
+    Parse JSON text incrementally and yield its parsing events, which are pairs
+    (event, value): ('start_map', None), ('map_key', key), ('end_map', None),
+    ('start_array', None), ('end_array', None), ('value', scalar). Scalars are
+    the same Python objects as json.loads() would give.
+
+    The read(n) callable must return up to n more characters of text, and ''
+    at the end. Only the text of the current token is held in memory, and there
+    is no limit on nesting depth. Raises ValueError if the text is not valid JSON.
+
+    If small_containers is True, an object or array whose text is entirely within
+    the next read_size characters is parsed by the json module's (much faster)
+    decoder and yielded as one ('value', dict or list) event. The items of the
+    arrays that are too big for that are also parsed by the decoder, in batches
+    of the items that are in the buffer, and yielded as ('array_items', list of
+    items) events. Memory use is then still bounded by read_size.
+    """
+    buf = ''
+    pos = 0
+    offset = 0  # offset in the text of buf[0]
+    eof = False
+    string_end_search = 0
+    stack = []  # '{' or '[' for each open container
+    state = _EXPECT_VALUE
+    # containers nested this deep are not given to the json decoder, which recursed too
+    # deep for a container that contains them
+    max_decode_depth = sys.maxsize
+    # offset of the end of buf when the decoder last failed (eg on a container that does
+    # not end in buf): it is not used again until more text is read
+    decode_failed_at = -1
+    batch_failed_at = -1  # same, for the decoding of all the items of an array up to a comma
+
+    def error(msg: str):
+        return ValueError('Invalid JSON at char {}: {}'.format(offset + pos, msg))
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+        if pos == len(buf) or (
+                # tokens that may be split across reads:
+                len(buf) - pos < _MAX_CONSTANT_LEN and buf[pos] not in '{}[],:"' and not eof):
+            if eof:
+                break
+            # read at least as much as the pending token so buffer growth is geometric
+            chunk = read(max(read_size, len(buf) - pos))
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            offset += pos
+            string_end_search -= pos
+            pos = 0
+            continue
+
+        char = buf[pos]
+        if small_containers and stack and stack[-1] == '[' and (
+                state == _EXPECT_VALUE or state == _EXPECT_VALUE_OR_END):
+            # decode the items of the array that are in buf, up to the first one that may not
+            # be: first all those before the last comma in buf, in one go, as an array (this
+            # fails if that comma is not between items of this array), then one by one
+            items = []
+            cut = buf.rfind(',', pos)
+            if cut != -1 and batch_failed_at != offset + len(buf):
+                try:
+                    items, end = _json_decoder.raw_decode('[' + buf[pos:cut] + ']')
+                except (ValueError, RecursionError):
+                    end = -1
+                if end == cut - pos + 2:
+                    pos = _WHITESPACE.match(buf, cut + 1).end()
+                    state = _EXPECT_VALUE
+                else:
+                    items = []
+                    batch_failed_at = offset + len(buf)
+            try:
+                while pos < len(buf):
+                    if buf[pos] in '{[' and (len(stack) >= max_decode_depth or
+                                             decode_failed_at == offset + len(buf)):
+                        break
+                    value, end = _json_decoder.scan_once(buf, pos)
+                    match = _ITEM_END.match(buf, end)
+                    if match is None:
+                        break  # the item may continue in the next read (or is followed by junk)
+                    items.append(value)
+                    state = _AFTER_VALUE
+                    if match.group(1) == ']':
+                        pos = end
+                        break
+                    pos = _WHITESPACE.match(buf, match.end()).end()
+                    state = _EXPECT_VALUE
+            except StopIteration:
+                pass  # not a value: error or end of array, see below
+            except RecursionError:
+                max_decode_depth = len(stack) + 1
+            except ValueError:
+                decode_failed_at = offset + len(buf)
+            if items:
+                string_end_search = 0
+                yield 'array_items', items
+                continue
+
+        if char == '"':
+            if state not in (_EXPECT_VALUE, _EXPECT_VALUE_OR_END, _EXPECT_KEY, _EXPECT_KEY_OR_END):
+                raise error('unexpected string')
+            end = _find_string_end(buf, max(pos + 1, string_end_search))
+            if end == -1:
+                if eof:
+                    raise error('unterminated string')
+                string_end_search = len(buf)
+                chunk = read(max(read_size, len(buf) - pos))
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                offset += pos
+                string_end_search -= pos
+                pos = 0
+                continue
+            value, pos = scanstring(buf, pos + 1, True)
+            string_end_search = 0
+            if state in (_EXPECT_KEY, _EXPECT_KEY_OR_END):
+                yield 'map_key', value
+                state = _EXPECT_COLON
+            else:
+                yield 'value', value
+                state = _AFTER_VALUE
+
+        elif char == '{' or char == '[':
+            if state not in (_EXPECT_VALUE, _EXPECT_VALUE_OR_END):
+                raise error('unexpected ' + char)
+            if small_containers and len(stack) < max_decode_depth:
+                if len(buf) - pos < read_size and not eof:
+                    chunk = read(read_size)
+                    eof = not chunk
+                    buf = buf[pos:] + chunk
+                    offset += pos
+                    pos = 0
+                    continue
+                if decode_failed_at != offset + len(buf):
+                    try:
+                        value, pos = _json_decoder.raw_decode(buf, pos)
+                    except ValueError:
+                        decode_failed_at = offset + len(buf)  # too big for buf (or invalid)
+                    except RecursionError:
+                        max_decode_depth = len(stack) + 1  # too deep: parse piecewise
+                    else:
+                        yield 'value', value
+                        state = _AFTER_VALUE
+                        continue
+
+            stack.append(char)
+            pos += 1
+            if char == '{':
+                yield 'start_map', None
+                state = _EXPECT_KEY_OR_END
+            else:
+                yield 'start_array', None
+                state = _EXPECT_VALUE_OR_END
+
+        elif char == '}' or char == ']':
+            opener = '{' if char == '}' else '['
+            allowed = _EXPECT_KEY_OR_END if char == '}' else _EXPECT_VALUE_OR_END
+            if not stack or stack[-1] != opener or state not in (allowed, _AFTER_VALUE):
+                raise error('unexpected ' + char)
+            stack.pop()
+            pos += 1
+            yield ('end_map' if char == '}' else 'end_array'), None
+            state = _AFTER_VALUE
+
+        elif char == ',':
+            if state != _AFTER_VALUE or not stack:
+                raise error('unexpected ,')
+            pos += 1
+            state = _EXPECT_KEY if stack[-1] == '{' else _EXPECT_VALUE
+
+        elif char == ':':
+            if state != _EXPECT_COLON:
+                raise error('unexpected :')
+            pos += 1
+            state = _EXPECT_VALUE
+
+        else:
+            if state not in (_EXPECT_VALUE, _EXPECT_VALUE_OR_END):
+                raise error('unexpected data' if stack or state != _AFTER_VALUE else 'extra data')
+            match = _NUMBER.match(buf, pos)
+            if match and not eof and _NUMBER_CUT.fullmatch(buf, match.end()):
+                # number may continue in next read (possibly cut just after '.', 'e' or 'e-')
+                chunk = read(max(read_size, len(buf) - pos))
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                offset += pos
+                pos = 0
+                continue
+
+            if match and not buf.startswith('-Infinity', pos):
+                integer, frac, exp = match.group(0, 1, 2)
+                value = float(integer) if frac or exp else int(integer)
+                pos = match.end()
+            else:
+                for name, value in _CONSTANTS:
+                    if buf.startswith(name, pos):
+                        pos += len(name)
+                        break
+                else:
+                    raise error('expecting value')
+            yield 'value', value
+            state = _AFTER_VALUE
+
+    if stack or state != _AFTER_VALUE:
+        raise error('unexpected end of data')
+
+
+class _ChunkedTextWriter:
+    """
+    Accumulates pieces of text and gives them, UTF-8 encoded, to write_bytes()
+    in chunks of roughly chunk_size characters.
+    """
+
+    def __init__(self, write_bytes: Callable[[bytes], None], chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self._write_bytes = write_bytes
+        self._chunk_size = chunk_size
+        self._pieces = []
+        self._size = 0
+
+    def write(self, text: str):
+        self._pieces.append(text)
+        self._size += len(text)
+        if self._size >= self._chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self._pieces:
+            self._write_bytes(''.join(self._pieces).encode('UTF-8'))
+            self._pieces = []
+            self._size = 0
+
+
+class _CanonicalTextFromEvents:
+    """
+    Produces the canonical text of a document (same as _iter_canonical_chunks())
+    from its parsing events; 'value' events can also be whole dicts or lists,
+    and 'array_items' events give several items of the current array at once.
+    Text is written out as soon as it is known; only the text of objects must
+    be held until the object ends, since its keys must be sorted. Therefore a
+    document that is an array of objects needs memory for one object at a time.
+    The text of the values of an object is held as lists of pieces, which are
+    joined only once written out, so that nested objects are not copied once
+    per level.
+    """
+
+    def __init__(self, write: Callable[[str], None]):
+        self._write = write  # where text of the current value goes
+        self._extend = lambda pieces: write(''.join(pieces))  # same, for a list of pieces
+        # per open container: ['[', parent write, has items] or
+        # ['{', parent write, parent extend, items, key, value pieces]
+        self._stack = []
+
+    def _begin_value(self):
+        if self._stack and self._stack[-1][0] == '[':
+            frame = self._stack[-1]
+            if frame[2]:
+                self._write(', ')
+            frame[2] = True
+
+    def _end_value(self):
+        if self._stack and self._stack[-1][0] == '{':
+            frame = self._stack[-1]
+            frame[3][frame[4]] = frame[5]
+
+    def event(self, event: str, value):
+        if event == 'value':
+            self._begin_value()
+            if type(value) in _SCALAR_TYPES:
+                self._write(repr(str(value)))
+            else:
+                self._write(_get_canonical_str(value))
+            self._end_value()
+        elif event == 'array_items':
+            text = _get_canonical_str(value)[1:-1]  # without the brackets of the list
+            frame = self._stack[-1]
+            self._write(', ' + text if frame[2] else text)
+            frame[2] = True
+        elif event == 'map_key':
+            frame = self._stack[-1]
+            frame[4] = value
+            frame[5] = pieces = []
+            self._write = pieces.append
+            self._extend = pieces.extend
+        elif event == 'start_map':
+            self._begin_value()
+            self._stack.append(['{', self._write, self._extend, {}, None, None])
+        elif event == 'end_map':
+            _, self._write, self._extend, items, _, _ = self._stack.pop()
+            if items:
+                sorted_keys, key_prefixes = _key_orders.get(tuple(items))
+                pieces = []
+                for key, key_prefix in zip(sorted_keys, key_prefixes):
+                    pieces.append(key_prefix)
+                    pieces.extend(items[key])
+                pieces.append('}')
+                self._extend(pieces)
+            else:
+                self._write('{}')
+            self._end_value()
+        elif event == 'start_array':
+            self._begin_value()
+            self._write('[')
+            self._stack.append(['[', self._write, False])
+        elif event == 'end_array':
+            _, self._write, _ = self._stack.pop()
+            self._write(']')
+            self._end_value()
+        else:
+            raise ValueError('Unknown JSON event "{}"'.format(event))
+
+
+JsonSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+
+def _get_text_reader(stream) -> Callable[[int], str]:
+    """Get a read(n) callable that returns decoded text from a binary (or text) file object"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+
+    def read(size: int) -> str:
+        while True:
+            data = stream.read(size)
+            if isinstance(data, str):
+                return data
+            text = decoder.decode(data, final=not data)
+            if text or not data:
+                return text
+
+    return read
+
+
+def get_json_stream_sem_hash(source: JsonSource, hasher=hashlib.sha256,
+                             chunk_size: int = DEFAULT_CHUNK_SIZE) -> str:
+    """
+    Get the same hash as get_json_sem_hash(json.load(source)) but without ever
+    loading the document into Python objects: the JSON text is parsed
+    incrementally, chunk_size characters at a time, and its canonical text is
+    streamed to the hasher. The source can be a file path (str or Path), a
+    bytes-like object containing UTF-8 JSON, or a binary file object opened
+    for reading (which is not closed). The hasher is a hashlib-style constructor
+    or algorithm name (see get_hasher()).
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as stream:
+            return get_json_stream_sem_hash(stream, hasher, chunk_size)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = io.BytesIO(source)
+
+    if isinstance(hasher, str):
+        hasher = get_hasher(hasher)
+    hash_obj = hasher()
+    writer = _ChunkedTextWriter(hash_obj.update, chunk_size)
+    canonical = _CanonicalTextFromEvents(writer.write)
+    for event, value in iter_json_events(_get_text_reader(source), chunk_size,
+                                         small_containers=True):
+        canonical.event(event, value)
+    writer.flush()
+    return hash_obj.hexdigest()
+
+
+# events of ijson.basic_parse() for scalars, which are 'value' events of iter_json_events()
+_IJSON_SCALAR_EVENTS = frozenset(('null', 'boolean', 'integer', 'double', 'number', 'string'))
+
+
+class JsonSemEventHasher:
+    """
+    Hashes a JSON document given as a sequence of events, for producers that
+    never build the document, eg
+    ```
+    hasher = JsonSemEventHasher()
+    hasher.start_object()
+    hasher.key('name')
+    hasher.value('web')
+    hasher.key('ports')
+    hasher.start_array()
+    for port in ports:
+        hasher.value(port)
+    hasher.end_array()
+    hasher.end_object()
+    print(hasher.hexdigest())
+    ```
+    gives get_json_sem_hash({'name': 'web', 'ports': ports}). A value can also
+    be a whole dict or list. Events can also be given as pairs as yielded by
+    iter_json_events() or by ijson.basic_parse(), see event() and feed().
+
+    - hasher: a hashlib-style constructor or algorithm name (see get_hasher())
+    - merkle: if True, the digest is the root digest of get_json_sem_merkle()
+      instead of get_json_sem_hash()
+    - chunk_size: number of characters of canonical text given to the hasher at once
+
+    Memory: the keys of an object must be sorted before hashing, so for the
+    hash of get_json_sem_hash(), the canonical text of each open object must
+    be held until the object ends (the text of arrays is hashed as soon as it
+    is known). With merkle=True, only one digest per key of each open object,
+    and one hash object per open array, are held: memory is proportional to
+    the nesting depth times the width of the open objects, whatever the size
+    of their values.
+
+    Events that do not make a JSON document (eg a value where a key is
+    expected, or end_array() in an object) raise ValueError.
+    """
+
+    def __init__(self, hasher=hashlib.sha256, merkle: bool = False,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if isinstance(hasher, str):
+            hasher = get_hasher(hasher)
+        self._hasher = hasher
+        self._merkle = merkle
+        self._open = []  # '{' or '[' per open container
+        self._expect_key = False
+        self._done = False
+        if merkle:
+            # per open container: [key -> digest, current key] for an object,
+            # hash object for an array
+            self._frames = []
+            self._digest = None
+        else:
+            self._hash_obj = hasher()
+            self._writer = _ChunkedTextWriter(self._hash_obj.update, chunk_size)
+            self._canonical = _CanonicalTextFromEvents(self._writer.write)
+
+    def start_object(self):
+        self.event('start_map')
+
+    def key(self, key: str):
+        self.event('map_key', key)
+
+    def end_object(self):
+        self.event('end_map')
+
+    def start_array(self):
+        self.event('start_array')
+
+    def end_array(self):
+        self.event('end_array')
+
+    def value(self, value: JsonType):
+        self.event('value', value)
+
+    def feed(self, events: Iterable[Tuple[str, object]]):
+        """Give each (event, value) pair of events to event()"""
+        for event, value in events:
+            self.event(event, value)
+
+    def event(self, event: str, value=None):
+        """
+        Give the next event: one of 'start_map', 'map_key' (value is the key),
+        'end_map', 'start_array', 'end_array', 'value' (value is a scalar, dict
+        or list), as yielded by iter_json_events(); its 'array_items' events are
+        given as one 'value' event per item. The scalar events of the
+        ijson package ('null', 'boolean', 'integer', 'double', 'number',
+        'string') are also accepted, as 'value' events; its Decimal numbers are
+        hashed as floats, as json.loads() would give them.
+        """
+        open_containers = self._open
+        if event == 'array_items':
+            for item in value:
+                self.event('value', item)
+            return
+        if event in _IJSON_SCALAR_EVENTS:
+            event = 'value'
+            if type(value) is Decimal:
+                value = float(value)
+        if self._done:
+            raise ValueError('JSON event "{}" after the end of the document'.format(event))
+        if event == 'value' or event == 'start_map' or event == 'start_array':
+            if self._expect_key:
+                raise ValueError('Expected a key, got JSON event "{}"'.format(event))
+        elif event == 'map_key':
+            if not self._expect_key:
+                raise ValueError('Unexpected key {!r}'.format(value))
+            self._expect_key = False
+        elif event == 'end_map' or event == 'end_array':
+            expected = '{' if event == 'end_map' else '['
+            if not open_containers or open_containers[-1] != expected or (
+                    expected == '{' and not self._expect_key):
+                raise ValueError('Unexpected JSON event "{}"'.format(event))
+        else:
+            raise ValueError('Unknown JSON event "{}"'.format(event))
+
+        if self._merkle:
+            self._merkle_event(event, value)
+        else:
+            self._canonical.event(event, value)
+
+        if event == 'start_map':
+            open_containers.append('{')
+            self._expect_key = True
+        elif event == 'start_array':
+            open_containers.append('[')
+        elif event != 'map_key':  # end of a value
+            if event != 'value':
+                open_containers.pop()
+            if open_containers:
+                self._expect_key = open_containers[-1] == '{'
+            else:
+                self._done = True
+                if not self._merkle:
+                    self._writer.flush()
+
+    def _merkle_event(self, event: str, value):
+        frames = self._frames
+        if event == 'map_key':
+            frames[-1][1] = value
+            return
+        if event == 'value':
+            if type(value) in _SCALAR_TYPES:
+                digest = self._hasher(bytes(repr(str(value)), 'UTF-8')).digest()
+            else:
+                digest = _get_merkle_node(value, self._hasher).digest
+        elif event == 'start_map':
+            frames.append([{}, None])
+            return
+        elif event == 'start_array':
+            frames.append(self._hasher(b'['))
+            return
+        elif event == 'end_map':
+            children, _ = frames.pop()
+            hash_obj = self._hasher(b'{')
+            for key in sorted(children.keys()):
+                hash_obj.update(bytes(repr(key), 'UTF-8') + b':' + children[key])
+            hash_obj.update(b'}')
+            digest = hash_obj.digest()
+        else:
+            hash_obj = frames.pop()
+            hash_obj.update(b']')
+            digest = hash_obj.digest()
+
+        if not frames:
+            self._digest = digest
+        elif type(frames[-1]) is list:
+            frames[-1][0][frames[-1][1]] = digest
+        else:
+            frames[-1].update(digest)
+
+    def _check_done(self):
+        if not self._done:
+            raise ValueError('The JSON document is not complete')
+
+    def digest(self) -> bytes:
+        """Get the digest of the document; raises ValueError if it is not complete"""
+        self._check_done()
+        return self._digest if self._merkle else self._hash_obj.digest()
+
+    def hexdigest(self) -> str:
+        """Get the hex digest of the document; raises ValueError if it is not complete"""
+        return self.digest().hex()
+
+
+# a file modified this recently (in seconds) may change again without a change of
+# size or mtime (the mtime resolution of some file systems is 1 or 2 seconds)
+_RACY_MTIME_DELAY = 2.0
+
+
+def _hash_file(path: str, algorithm: str, load: Callable[[BinaryIO], JsonType] = None) -> str:
+    if load is None:
+        return get_json_stream_sem_hash(path, get_hasher(algorithm))
+    with open(path, 'rb') as stream:
+        return get_json_sem_hash(load(stream), get_hasher(algorithm))
+
+
+def _get_file_identity(stat: os.stat_result) -> Tuple[int, int, int]:
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class _SqliteDb:
+    """
+    Base of the classes that keep their data in an SQLite database that several
+    processes can use at the same time (see JsonSemHashCache): reads are not
+    blocked by writes in write-ahead log mode, and writers wait up to timeout
+    seconds for each other. The schema script must only create what does not
+    exist yet. The settings, if any, are saved in the database when it is new,
+    else checked: if they are not the saved ones, ValueError is raised.
+    """
+
+    def __init__(self, db_path: Union[str, os.PathLike], timeout: float, schema: str,
+                 settings: Dict[str, str] = None):
+        self._db = sqlite3.connect(os.fspath(db_path), timeout=timeout)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        if settings is not None:
+            schema = ('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, '
+                      'value TEXT NOT NULL);' + schema)
+        self._db.executescript(schema)
+        if settings is not None:
+            with self._db:
+                self._db.executemany('INSERT OR IGNORE INTO settings VALUES (?, ?)',
+                                     settings.items())
+                saved = dict(self._db.execute('SELECT name, value FROM settings'))
+            if saved != settings:
+                self._db.close()
+                raise ValueError('Database {} uses {}, not {}'.format(db_path, saved, settings))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+
+class JsonSemHashCache(_SqliteDb):
+    """
+    Persistent cache of the semantic hashes of JSON files, in an SQLite
+    database, so that the files that did not change since they were last
+    hashed are neither parsed nor hashed again. Eg
+    ```
+    with JsonSemHashCache('json_hashes.db') as cache:
+        hashes = cache.get_file_hashes(glob.glob('configs/**/*.json', recursive=True))
+    ```
+    An entry is kept per file path (made absolute) and hash algorithm name,
+    and is valid as long as the inode, size and modification time (in ns) of
+    the file are the same. Files that were modified less than 2 seconds before
+    being hashed are not cached, since they could change again without a
+    change of modification time.
+
+    Several processes can use the same database at the same time: the database
+    is in write-ahead log mode, so reads are not blocked by writes, and a
+    process waits up to timeout seconds for another one to finish writing.
+    A JsonSemHashCache object must only be used by the thread that created it.
+
+    - db_path: path of the database file; created if it does not exist
+    - load: if given, files are read with load(binary file) (eg yaml.safe_load)
+      and the result hashed with get_json_sem_hash(), instead of being hashed
+      as JSON with get_json_stream_sem_hash(). The cache does not know about
+      load, so use a different database for each.
+    - timeout: seconds to wait for the database to be unlocked by other processes
+    """
+
+    def __init__(self, db_path: Union[str, os.PathLike],
+                 load: Callable[[BinaryIO], JsonType] = None, timeout: float = 30.0):
+        self._load = load
+        super().__init__(
+            db_path, timeout,
+            'CREATE TABLE IF NOT EXISTS file_hashes (path TEXT NOT NULL, algorithm TEXT NOT NULL, '
+            'inode INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+            'hash TEXT NOT NULL, PRIMARY KEY (path, algorithm));')
+
+    def get_file_hash(self, path: Union[str, os.PathLike], algorithm: str = 'sha256') -> str:
+        """Get the semantic hash of the JSON file at path; see get_file_hashes()"""
+        return self.get_file_hashes([path], algorithm)[0]
+
+    def get_file_hashes(self, paths: Iterable[Union[str, os.PathLike]], algorithm: str = 'sha256',
+                        workers: Optional[int] = 1) -> List[str]:
+        """
+        Get the semantic hash of each JSON file of paths, in the same order as
+        paths: from the cache if the file did not change, else by hashing it
+        and caching the result. The algorithm is a name for get_hasher(). The
+        files to hash are hashed by workers processes (see iter_json_sem_hashes(),
+        but the default is to hash in the current process). Raises OSError if
+        a file cannot be read and ValueError if it is not valid JSON, in which
+        case nothing is cached.
+        """
+        get_hasher(algorithm)  # raises ValueError if unknown
+        paths = [os.path.abspath(path) for path in paths]
+        start = time.time()
+        stats = [os.stat(path) for path in paths]
+        hashes = []
+        missing = []  # indices in paths
+        select = ('SELECT inode, size, mtime_ns, hash FROM file_hashes '
+                  'WHERE path = ? AND algorithm = ?')
+        for index, (path, stat) in enumerate(zip(paths, stats)):
+            row = self._db.execute(select, (path, algorithm)).fetchone()
+            if row is not None and row[:3] == _get_file_identity(stat):
+                hashes.append(row[3])
+            else:
+                hashes.append(None)
+                missing.append(index)
+        if not missing:
+            return hashes
+
+        hash_file = partial(_hash_file, algorithm=algorithm, load=self._load)
+        rows = []
+        for index, file_hash in zip(missing, _imap(hash_file, [paths[index] for index in missing],
+                                                   workers, 1)):
+            hashes[index] = file_hash
+            identity = _get_file_identity(stats[index])
+            # only cache if the file did not change while being hashed
+            if (start - stats[index].st_mtime > _RACY_MTIME_DELAY
+                    and _get_file_identity(os.stat(paths[index])) == identity):
+                rows.append((paths[index], algorithm) + identity + (file_hash,))
+        with self._db:
+            self._db.executemany('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?)',
+                                 rows)
+        return hashes
+
+    def evict_missing(self) -> int:
+        """Remove the entries of the files that no longer exist; returns their number"""
+        paths = [path for path, in self._db.execute('SELECT DISTINCT path FROM file_hashes')
+                 if not os.path.exists(path)]
+        with self._db:
+            self._db.executemany('DELETE FROM file_hashes WHERE path = ?',
+                                 [(path,) for path in paths])
+        return len(paths)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._db:
+            self._db.execute('DELETE FROM file_hashes')
+
+
+class JsonSemStore(_SqliteDb):
+    """
+    Content-addressed store of JSON documents in an SQLite database: each
+    document is stored once, under its semantic hash, so that equivalent
+    documents (eg snapshots of a config that did not change) take no more
+    space. Eg
+    ```
+    with JsonSemStore('snapshots.db') as store:
+        doc_hash = store.put(config)
+        assert doc_hash in store and store.get(doc_hash) == config
+    ```
+    Documents are stored as compact JSON, compressed with zlib; a document that
+    is already in the store is not serialized or written again.
+
+    - db_path, timeout: as for JsonSemHashCache, which also tells how the database
+      can be shared
+    - algorithm: hash algorithm name (see get_hasher())
+    - encoding: canonical encoding of the hash (see get_json_sem_hash()). The
+      default 'tagged' keeps types apart, so that eg {'a': 1} and {'a': '1'}
+      are different documents; with 'repr' they would have the same hash, and
+      get() would return whichever was stored first. With 'jcs', a document
+      is hashed and serialized in a single pass, and get() returns the
+      canonical JSON of the document (eg 1.0 becomes 1).
+
+    The algorithm and encoding are saved in the database, and opening it with
+    different ones raises ValueError, since the hashes would not match.
+    Storing a document whose JSON does not have the same hash as the document
+    itself (eg one with int keys) raises ValueError, since get() could then
+    not return it.
+    """
+
+    def __init__(self, db_path: Union[str, os.PathLike], algorithm: str = 'sha256',
+                 encoding: str = 'tagged', timeout: float = 30.0):
+        if encoding not in ENCODINGS:
+            raise ValueError('Unknown encoding {!r}, must be one of {}'.format(encoding, ENCODINGS))
+        self._hasher = get_hasher(algorithm)
+        self._encoding = encoding
+        super().__init__(
+            db_path, timeout,
+            'CREATE TABLE IF NOT EXISTS docs (hash TEXT PRIMARY KEY, data BLOB NOT NULL) '
+            'WITHOUT ROWID;',
+            {'algorithm': algorithm, 'encoding': encoding})
+
+    def __contains__(self, doc_hash: str) -> bool:
+        row = self._db.execute('SELECT 1 FROM docs WHERE hash = ?', (doc_hash,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the hashes of the documents in the store"""
+        return (doc_hash for doc_hash, in self._db.execute('SELECT hash FROM docs'))
+
+    def _hash(self, doc: JsonType) -> Tuple[str, Optional[bytes]]:
+        """Get the hash of doc, and its JSON if it was made while hashing"""
+        if self._encoding == 'jcs':
+            stream = io.BytesIO()
+            doc_hash, = write_canonical_json(doc, stream, [self._hasher])
+            return doc_hash, stream.getvalue()
+        return get_json_sem_hash(doc, self._hasher, encoding=self._encoding), None
+
+    def put(self, doc: JsonType) -> str:
+        """Store doc, if not already in the store; returns its hash"""
+        return self.put_many([doc])[0]
+
+    def put_many(self, docs: Iterable[JsonType]) -> List[str]:
+        """
+        Store each doc of docs that is not already in the store, in a single
+        transaction; returns their hashes, in the same order as docs. Raises
+        ValueError, and stores none of docs, if the JSON of a doc does not have
+        the same hash as the doc.
+        """
+        hashes = []
+        new_docs = {}  # hash -> JSON
+        for doc in docs:
+            doc_hash, text = self._hash(doc)
+            hashes.append(doc_hash)
+            if doc_hash not in new_docs and doc_hash not in self:
+                if text is None:
+                    text = json.dumps(doc, ensure_ascii=False, separators=(',', ':'))
+                    if self._hash(json.loads(text))[0] != doc_hash:
+                        raise ValueError('Document {} is not the same once converted to '
+                                         'JSON: {}'.format(doc_hash, text[:100]))
+                    text = text.encode('UTF-8')
+                new_docs[doc_hash] = zlib.compress(text)
+        with self._db:
+            self._db.executemany('INSERT OR IGNORE INTO docs VALUES (?, ?)', new_docs.items())
+        return hashes
+
+    def get(self, doc_hash: str) -> JsonType:
+        """Get the document of the given hash; raises KeyError if not in the store"""
+        row = self._db.execute('SELECT data FROM docs WHERE hash = ?', (doc_hash,)).fetchone()
+        if row is None:
+            raise KeyError(doc_hash)
+        return json.loads(zlib.decompress(row[0]).decode('UTF-8'))
+
+
+def iter_json_shingles(data: JsonType, unordered: bool = False) -> Iterator[int]:
+    """
+    Yield the shingles of data, for similarity search: one per leaf (value
+    that is not a container, or empty container), a 32-bit hash of its path
+    and its canonical text (as in the text hashed by get_json_sem_hash()), eg of
+    "['spec']['replicas']='3'". Two documents are similar if most of their
+    shingles are the same. Dicts are walked in sorted key order, as by
+    sorted_dict_str(). If unordered is True, list indices are left out of
+    paths, so the order of list items does not matter. The walk uses an
+    explicit stack and the path hash is updated incrementally (crc32 of the
+    parent path hash and the key), so deep documents take linear time.
+    """
+    stack = [(0, data)]  # (hash of path, value)
+    pop, push = stack.pop, stack.append
+    ndarray = _get_ndarray_type()
+    while stack:
+        path_hash, value = pop()
+        value_type = type(value)
+        if isinstance(value, ndarray):
+            value = value.tolist()
+            value_type = type(value)
+        if value_type is dict and value:
+            for key in sorted(value):
+                push((zlib.crc32(('[' + repr(key) + ']').encode('UTF-8'), path_hash), value[key]))
+        elif value_type is list and value:
+            if unordered:
+                path_hash = zlib.crc32(b'[*]', path_hash)
+                for item in value:
+                    push((path_hash, item))
+            else:
+                for index, item in enumerate(value):
+                    push((zlib.crc32(b'[%d]' % index, path_hash), item))
+        else:
+            text = '{}' if value_type is dict else '[]' if value_type is list else repr(str(value))
+            yield zlib.crc32(('=' + text).encode('UTF-8'), path_hash)
+
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_minhash_params = {}  # num_perm -> (multipliers, increments)
+
+
+def _get_minhash_params(num_perm: int) -> Tuple[List[int], List[int]]:
+    """
+    Get the parameters a and b of the num_perm hash functions (a * x + b) mod
+    2 ** 61 - 1 of MinHash signatures; they are derived from a fixed string so
+    that signatures can be saved and compared across processes and platforms.
+    With x and a, b < 2 ** 32, a * x + b < 2 ** 64, so numpy uint64 gives the
+    same results as Python ints.
+    """
+    params = _minhash_params.get(num_perm)
+    if params is None:
+        digests = [hashlib.blake2b(b'json_sem_hash minhash %d' % index, digest_size=8).digest()
+                   for index in range(num_perm)]
+        params = _minhash_params[num_perm] = (
+            [int.from_bytes(digest[:4], 'little') | 1 for digest in digests],
+            [int.from_bytes(digest[4:], 'little') for digest in digests])
+    return params
+
+
+def get_json_minhash(data: JsonType, num_perm: int = DEFAULT_NUM_PERM,
+                     unordered: bool = False) -> List[int]:
+    """
+    Get the MinHash signature of the shingles of data (see iter_json_shingles()):
+    for each of num_perm hash functions, the minimum hash of the shingles. The
+    fraction of equal values in the signatures of 2 documents estimates the
+    Jaccard similarity of their shingles (size of the intersection / size of
+    the union), with a standard error of about 1 / sqrt(num_perm). Uses numpy
+    if it is installed, for speed; the results are the same without.
+    """
+    shingles = set(iter_json_shingles(data, unordered))
+    multipliers, increments = _get_minhash_params(num_perm)
+    try:
+        import numpy
+    except ImportError:
+        return [min((a * x + b) % _MERSENNE_PRIME for x in shingles)
+                for a, b in zip(multipliers, increments)]
+
+    shingles = numpy.fromiter(shingles, numpy.uint64, len(shingles))
+    multipliers = numpy.array(multipliers, numpy.uint64)
+    increments = numpy.array(increments, numpy.uint64)
+    signature = numpy.full(num_perm, _MERSENNE_PRIME, numpy.uint64)
+    for start in range(0, len(shingles), 1024):  # bounds the memory of the outer product
+        hashes = (numpy.outer(shingles[start:start + 1024], multipliers) + increments)
+        numpy.minimum(signature, (hashes % _MERSENNE_PRIME).min(axis=0), out=signature)
+    return signature.tolist()
+
+
+def _get_signature_similarity(signature_a: Sequence[int], signature_b: Sequence[int]) -> float:
+    return sum(map(int.__eq__, signature_a, signature_b)) / len(signature_a)
+
+
+class JsonSimilarityIndex(_SqliteDb):
+    """
+    Index of JSON documents for near-duplicate search, in an SQLite database:
+    query(doc) finds the documents of the index whose shingles are mostly the
+    same as those of doc (see iter_json_shingles()), without comparing doc
+    with all of them. Eg
+    ```
+    with JsonSimilarityIndex('configs.db') as index:
+        index.add_many(configs.items())
+        near_duplicates = index.query(new_config, threshold=0.95)
+    ```
+    Each document has a MinHash signature (see get_json_minhash()), split in
+    num_bands bands (locality-sensitive hashing): documents that have at
+    least one band equal are candidates, and the candidates whose signature is
+    similar enough are the results. With the defaults (16 bands of 8 values),
+    a document with a similarity of 0.95 is a candidate with a probability
+    above 0.999999, 0.7 with 0.6, and 0.5 with 0.06. Documents can be added and
+    removed at any time; they are identified by an id, eg their hash in a
+    JsonSemStore.
+
+    - db_path, timeout: as for JsonSemHashCache, which also tells how the database
+      can be shared
+    - num_perm: number of values of the signatures; must be a multiple of num_bands
+    - num_bands: number of bands of the signatures
+    - unordered: see iter_json_shingles()
+
+    The num_perm, num_bands and unordered arguments are saved in the database,
+    and opening it with different ones raises ValueError.
+    """
+
+    def __init__(self, db_path: Union[str, os.PathLike], num_perm: int = DEFAULT_NUM_PERM,
+                 num_bands: int = DEFAULT_NUM_BANDS, unordered: bool = False,
+                 timeout: float = 30.0):
+        if num_perm % num_bands:
+            raise ValueError('num_perm {} is not a multiple of num_bands {}'.format(
+                num_perm, num_bands))
+        self._num_perm = num_perm
+        self._num_bands = num_bands
+        self._unordered = unordered
+        self._band_struct = Struct('<{}Q'.format(num_perm // num_bands))
+        super().__init__(
+            db_path, timeout,
+            'CREATE TABLE IF NOT EXISTS signatures (id TEXT PRIMARY KEY, signature BLOB NOT NULL) '
+            'WITHOUT ROWID;'
+            'CREATE TABLE IF NOT EXISTS buckets (band INTEGER NOT NULL, bucket INTEGER NOT NULL, '
+            'id TEXT NOT NULL, PRIMARY KEY (band, bucket, id)) WITHOUT ROWID;',
+            {'num_perm': str(num_perm), 'num_bands': str(num_bands), 'unordered': str(unordered)})
+
+    def __contains__(self, doc_id: str) -> bool:
+        return self._get_signature(doc_id) is not None
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM signatures').fetchone()[0]
+
+    def _get_buckets(self, signature: List[int]) -> List[Tuple[int, int]]:
+        """Get (band index, bucket) for each band of signature; bucket is a hash of the band"""
+        band_size = self._num_perm // self._num_bands
+        return [(band, int.from_bytes(hashlib.blake2b(self._band_struct.pack(
+                    *signature[band * band_size:(band + 1) * band_size]), digest_size=8).digest(),
+                    'little', signed=True))
+                for band in range(self._num_bands)]
+
+    def _get_signature(self, doc_id: str) -> Optional[List[int]]:
+        row = self._db.execute('SELECT signature FROM signatures WHERE id = ?',
+                               (doc_id,)).fetchone()
+        if row is None:
+            return None
+        signature = array('Q', row[0])
+        if _SWAP_BYTES:
+            signature.byteswap()
+        return signature.tolist()
+
+    def _remove(self, doc_id: str) -> bool:
+        signature = self._get_signature(doc_id)
+        if signature is None:
+            return False
+        buckets = [bucket + (doc_id,) for bucket in self._get_buckets(signature)]
+        self._db.executemany('DELETE FROM buckets WHERE band = ? AND bucket = ? AND id = ?',
+                             buckets)
+        self._db.execute('DELETE FROM signatures WHERE id = ?', (doc_id,))
+        return True
+
+    def add(self, doc_id: str, doc: JsonType):
+        """Add doc to the index, under doc_id; replaces the document of that id, if any"""
+        self.add_many([(doc_id, doc)])
+
+    def add_many(self, docs: Iterable[Tuple[str, JsonType]]):
+        """Add each (doc_id, doc) of docs to the index, in a single transaction"""
+        signatures = [(doc_id, get_json_minhash(doc, self._num_perm, self._unordered))
+                      for doc_id, doc in docs]
+        with self._db:
+            for doc_id, signature in signatures:
+                self._remove(doc_id)
+                packed = array('Q', signature)
+                if _SWAP_BYTES:
+                    packed.byteswap()
+                self._db.execute('INSERT INTO signatures VALUES (?, ?)', (doc_id, packed.tobytes()))
+                buckets = [bucket + (doc_id,) for bucket in self._get_buckets(signature)]
+                self._db.executemany('INSERT INTO buckets VALUES (?, ?, ?)', buckets)
+
+    def remove(self, doc_id: str) -> bool:
+        """Remove the document of doc_id from the index; returns False if it was not in it"""
+        with self._db:
+            return self._remove(doc_id)
+
+    def query(self, doc: JsonType, threshold: float = 0.9,
+              limit: Optional[int] = None) -> List[Tuple[str, float]]:
+        """
+        Get (doc_id, similarity) of the documents of the index that have an
+        estimated similarity with doc of at least threshold (see the class
+        docstring), most similar first, at most limit of them if limit is given.
+        """
+        signature = get_json_minhash(doc, self._num_perm, self._unordered)
+        candidates = set()
+        select = 'SELECT id FROM buckets WHERE band = ? AND bucket = ?'
+        for bucket in self._get_buckets(signature):
+            candidates.update(doc_id for doc_id, in self._db.execute(select, bucket))
+        results = []
+        for doc_id in candidates:
+            similarity = _get_signature_similarity(signature, self._get_signature(doc_id))
+            if similarity >= threshold:
+                results.append((doc_id, similarity))
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
+
+
+class JsonSubtreeIndex(_SqliteDb):
+    """
+    Index of the objects and arrays of JSON documents by their semantic
+    digest, in an SQLite database: find(fragment) gets the documents, and the
+    paths in them, of all the subtrees that are semantically equal to fragment,
+    without reading the documents. Eg
+    ```
+    with JsonSubtreeIndex('releases.db') as index:
+        index.add_many((name, values) for name, values in releases.items())
+        users = index.find({'limits': {'cpu': '1', 'memory': '1Gi'}})
+    ```
+    The digests are those of get_json_sem_merkle(), so a document is added in
+    one traversal. Empty objects and arrays, and leaves, are not indexed. Paths
+    are JSON pointers (RFC 6901) as in json_sem_diff(). To keep the database
+    small, digests are short by default (128 bits), paths are saved once and
+    referred to by number, and the digests of each document are saved
+    compressed, for remove(). Documents can be added and removed at any time;
+    they are identified by an id, eg their hash in a JsonSemStore.
+
+    - db_path, timeout: as for JsonSemHashCache, which also tells how the database
+      can be shared
+    - algorithm: name of the hash algorithm of the digests (see get_hasher())
+
+    The algorithm is saved in the database, and opening it with a different
+    one raises ValueError.
+    """
+
+    def __init__(self, db_path: Union[str, os.PathLike], algorithm: str = 'fast128',
+                 timeout: float = 30.0):
+        self._hasher = get_hasher(algorithm)
+        self._digest_size = self._hasher().digest_size
+        self._path_ids = {}  # JSON pointer -> id in the paths table
+        super().__init__(
+            db_path, timeout,
+            'CREATE TABLE IF NOT EXISTS docs (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, '
+            'digests BLOB NOT NULL);'
+            'CREATE TABLE IF NOT EXISTS paths (id INTEGER PRIMARY KEY, '
+            'pointer TEXT NOT NULL UNIQUE);'
+            'CREATE TABLE IF NOT EXISTS subtrees (digest BLOB NOT NULL, doc INTEGER NOT NULL, '
+            'path INTEGER NOT NULL, PRIMARY KEY (digest, doc, path)) WITHOUT ROWID;',
+            {'algorithm': algorithm})
+
+    def __contains__(self, doc_id: str) -> bool:
+        row = self._db.execute('SELECT 1 FROM docs WHERE name = ?', (doc_id,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM docs').fetchone()[0]
+
+    def _get_path_id(self, pointer: str) -> int:
+        path_id = self._path_ids.get(pointer)
+        if path_id is None:
+            self._db.execute('INSERT OR IGNORE INTO paths (pointer) VALUES (?)', (pointer,))
+            path_id, = self._db.execute('SELECT id FROM paths WHERE pointer = ?',
+                                        (pointer,)).fetchone()
+            self._path_ids[pointer] = path_id
+        return path_id
+
+    def _remove(self, doc_id: str) -> bool:
+        row = self._db.execute('SELECT id, digests FROM docs WHERE name = ?', (doc_id,)).fetchone()
+        if row is None:
+            return False
+        doc, digests = row
+        digests = zlib.decompress(digests)
+        size = self._digest_size
+        self._db.executemany('DELETE FROM subtrees WHERE digest = ? AND doc = ?',
+                             [(digests[start:start + size], doc)
+                              for start in range(0, len(digests), size)])
+        self._db.execute('DELETE FROM docs WHERE id = ?', (doc,))
+        return True
+
+    def add(self, doc_id: str, doc: JsonType):
+        """Add the subtrees of doc to the index under doc_id; replaces the document of that id"""
+        self.add_many([(doc_id, doc)])
+
+    def add_many(self, docs: Iterable[Tuple[str, JsonType]]):
+        """Add the subtrees of each (doc_id, doc) of docs to the index, in a single transaction"""
+        try:
+            with self._db:
+                for doc_id, doc in docs:
+                    self._add(doc_id, doc)
+        except BaseException:
+            self._path_ids.clear()  # the paths added by the transaction were rolled back
+            raise
+
+    def _add(self, doc_id: str, doc: JsonType):
+        escape = _escape_json_pointer_token
+        self._remove(doc_id)
+        subtrees = []  # (digest, JSON pointer)
+        # explicit stack (no depth limit) of (non-empty container node, JSON pointer)
+        stack = [(_get_merkle_node(doc, self._hasher), '')]
+        while stack:
+            node, pointer = stack.pop()
+            children = node.children
+            if not children:
+                continue
+            subtrees.append((node.digest, pointer))
+            if type(children) is dict:
+                stack.extend((child, pointer + '/' + escape(key))
+                             for key, child in children.items())
+            else:
+                stack.extend((child, pointer + '/' + str(index))
+                             for index, child in enumerate(children))
+
+        digests = b''.join({digest: None for digest, _ in subtrees})
+        doc = self._db.execute('INSERT INTO docs (name, digests) VALUES (?, ?)',
+                               (doc_id, zlib.compress(digests))).lastrowid
+        self._db.executemany('INSERT INTO subtrees VALUES (?, ?, ?)',
+                             [(digest, doc, self._get_path_id(pointer))
+                              for digest, pointer in subtrees])
+
+    def remove(self, doc_id: str) -> bool:
+        """Remove the document of doc_id from the index; returns False if it was not in it"""
+        with self._db:
+            return self._remove(doc_id)
+
+    def find(self, fragment: Union[JsonType, JsonSemNode],
+             limit: Optional[int] = None) -> List[Tuple[str, str]]:
+        """
+        Get (doc_id, JSON pointer) of the subtrees of the documents of the index
+        that are semantically equal to fragment, sorted, at most limit of them
+        if limit is given. The fragment can also be a JsonSemNode from
+        get_json_sem_merkle(), computed with the algorithm of the index.
+        """
+        if isinstance(fragment, JsonSemNode):
+            digest = fragment.digest
+        else:
+            digest = _get_merkle_node(fragment, self._hasher).digest
+        return self._db.execute(
+            'SELECT docs.name, paths.pointer FROM subtrees '
+            'JOIN docs ON docs.id = subtrees.doc JOIN paths ON paths.id = subtrees.path '
+            'WHERE subtrees.digest = ? ORDER BY docs.name, paths.pointer LIMIT ?',
+            (digest, -1 if limit is None else limit)).fetchall()
+
+
+def _hash_json_line(numbered_line: Tuple[str, int, bytes], algorithm: str,
+                    digest_size: Optional[int], encoding: str = 'repr') -> str:
+    path, line_num, line = numbered_line
+    if not line.strip():
+        return ''
+    try:
+        data = json.loads(line)
+    except ValueError as exc:
+        raise ValueError('{}:{}: invalid JSON: {}'.format(path, line_num, exc))
+    return get_json_sem_hash(data, get_hasher(algorithm, digest_size), encoding=encoding)
+
+
+def _iter_lines(paths: List[str]) -> Iterator[Tuple[str, int, bytes]]:
+    for path in paths:
+        if path == '-':
+            stream = sys.stdin.buffer
+        else:
+            stream = open(path, 'rb')
+        try:
+            for line_num, line in enumerate(stream, 1):
+                yield path, line_num, line
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command-line interface: print the semantic hash of each line of
+    newline-delimited JSON (NDJSON) files, in the same order as the lines.
+    Blank lines produce blank output lines so that output lines match input
+    lines. Run with --help for options.
+    """
+    parser = ArgumentParser(
+        prog='python -m json_sem_hash',
+        description='Print the semantic hash of each JSON document of newline-delimited JSON files')
+    parser.add_argument('paths', nargs='*', default=['-'], metavar='PATH',
+                        help='NDJSON file; "-" or none for stdin')
+    parser.add_argument('-a', '--algorithm', default='sha256',
+                        help='one of {}, or another hashlib algorithm name (default: %(default)s)'
+                        .format(', '.join(sorted(HASHERS))))
+    parser.add_argument('-d', '--digest-size', type=int,
+                        help='digest size in bytes, for blake2b and blake2s algorithms')
+    parser.add_argument('-e', '--encoding', choices=ENCODINGS, default='repr',
+                        help='canonical form that is hashed: jcs for canonical JSON (RFC 8785), '
+                             'tagged for type-tagged binary (default: %(default)s)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of worker processes, 0 for one per CPU (default: %(default)s)')
+    parser.add_argument('-c', '--chunksize', type=int, default=DEFAULT_DOCS_PER_TASK * 4,
+                        help='number of lines sent to a worker at a time (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    try:
+        get_hasher(args.algorithm, args.digest_size)
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    # lines are parsed in the workers, so the main process only reads and writes
+    hash_line = partial(_hash_json_line, algorithm=args.algorithm, digest_size=args.digest_size,
+                        encoding=args.encoding)
+    hashes = _imap(hash_line, _iter_lines(args.paths),
+                   args.workers or None, args.chunksize)
+    out = sys.stdout
+    try:
+        for line_hash in hashes:
+            out.write(line_hash + '\n')
+    except (ValueError, OSError) as exc:
+        print(exc, file=sys.stderr)
+        return 1
+    finally:
+        out.flush()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,428 @@
+"""
+Measure the speed of json_sem_hash.py functions on various shapes of JSON
+documents. Run this from a command shell; nothing to install besides the
+json_sem_hash.py module (same repo).
+
+The "legacy" hash is the original implementation of get_json_sem_hash(),
+ie the repr() of the tree built by sorted_dict_str(). It is recursive, so
+it cannot hash documents deeper than about the recursion limit.
+"""
+
+import base64
+import copy
+import os
+import random
+import tempfile
+import tracemalloc
+import hashlib
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from statistics import mean
+from time import perf_counter
+
+import json_sem_hash
+from json_sem_hash import (
+    sorted_dict_str, get_json_sem_hash, iter_canonical_bytes, json_sem_equal, HASHERS,
+    get_json_minhash, JsonSimilarityIndex, get_json_sem_merkle, JsonSubtreeIndex,
+    JsonSemEventHasher, get_json_stream_sem_hash)
+
+NUM_SAMPLES = 5
+
+
+def legacy_hash(data, hasher=hashlib.sha256) -> str:
+    return hasher(bytes(repr(sorted_dict_str(data)), 'UTF-8')).hexdigest()
+
+
+def get_deep_doc(depth: int):
+    data = 'leaf'
+    for level in range(depth):
+        data = {'child': data, 'level': level} if level % 2 else [level, data]
+    return data
+
+
+def get_wide_doc(width: int):
+    return {'key{}'.format(i): [i, 'value{}'.format(i)] for i in range(width)}
+
+
+def get_shared_doc(num_refs: int):
+    defaults = get_wide_doc(100)
+    return {'items': [{'name': i, 'defaults': defaults} for i in range(num_refs)]}
+
+
+def get_records_doc(num_records: int, num_keys: int = 10):
+    keys = ['field_{}'.format(i) for i in range(num_keys)]
+    return [{key: i for key in keys} for i in range(num_records)]
+
+
+def get_heterogeneous_doc(num_records: int, num_keys: int = 10):
+    return [{'field_{}_{}'.format(i, j): i for j in range(num_keys)} for i in range(num_records)]
+
+
+def get_pods_doc(num_pods: int):
+    return [{
+        'metadata': {'name': 'pod{}'.format(i), 'generation': i, 'labels': {'app': 'web'}},
+        'spec': {'containers': [{'image': 'nginx', 'ports': list(range(10))}] * 3},
+        'status': {'phase': 'Running', 'conditions': [{'type': 'Ready', 'timestamp': i}] * 5},
+    } for i in range(num_pods)]
+
+
+def time_func(func, data) -> float:
+    times = []
+    for i in range(NUM_SAMPLES):
+        start = perf_counter()
+        func(data)
+        times.append(perf_counter() - start)
+    return mean(times)
+
+
+def compare_deep_wide():
+    print('Comparing legacy (recursive) and current (explicit stack) hashing, '
+          'mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>8} {:>12} {:>12} {:>8}'.format('document', '# nodes', 'legacy (s)', 'current (s)',
+                                                   'ratio'))
+    max_legacy_depth = sys.getrecursionlimit() // 3
+    docs = [
+        ('deep ({} levels) x 200'.format(max_legacy_depth), [get_deep_doc(max_legacy_depth)] * 200,
+         200 * 2 * max_legacy_depth),
+        ('wide (100000 keys)', get_wide_doc(100000), 3 * 100000),
+        ('deep (100000 levels)', get_deep_doc(100000), 2 * 100000),
+    ]
+    for label, data, num_nodes in docs:
+        try:
+            legacy_time = time_func(legacy_hash, data)
+        except RecursionError:
+            legacy_time = None
+        current_time = time_func(get_json_sem_hash, data)
+        if legacy_time is None:
+            print('{:30} {:8} {:>12} {:12.3f} {:>8}'.format(
+                label, num_nodes, 'RecursionError', current_time, ''))
+        else:
+            print('{:30} {:8} {:12.3f} {:12.3f} {:8.2f}'.format(
+                label, num_nodes, legacy_time, current_time, legacy_time / current_time))
+    print('')
+
+
+def compare_memo():
+    print('Comparing hashing with and without memo of shared sub-objects, '
+          'mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('document', 'no memo (s)', 'memo (s)', 'ratio'))
+    docs = [
+        ('shared block x 10000', get_shared_doc(10000)),
+        ('no sharing', get_wide_doc(100000)),
+    ]
+    for label, data in docs:
+        time_no_memo = time_func(get_json_sem_hash, data)
+        time_memo = time_func(partial(get_json_sem_hash, memo=True), data)
+        print('{:30} {:12.3f} {:12.3f} {:8.2f}'.format(
+            label, time_no_memo, time_memo, time_no_memo / time_memo))
+    print('')
+
+
+def compare_key_order_cache():
+    print('Comparing hashing with and without cache of sorted dict keys, '
+          'mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('document', 'no cache (s)', 'cache (s)', 'ratio'))
+    docs = [
+        ('100000 records of 10 keys', get_records_doc(100000)),
+        ('100000 records of 50 keys', get_records_doc(100000, 50)),
+        ('100000 different dicts', get_heterogeneous_doc(100000)),
+    ]
+    cache_size = json_sem_hash.KEY_ORDER_CACHE_SIZE
+    for label, data in docs:
+        json_sem_hash.KEY_ORDER_CACHE_SIZE = 0
+        time_no_cache = time_func(get_json_sem_hash, data)
+        json_sem_hash.KEY_ORDER_CACHE_SIZE = cache_size
+        time_cache = time_func(get_json_sem_hash, data)
+        print('{:30} {:12.3f} {:12.3f} {:8.2f}'.format(
+            label, time_no_cache, time_cache, time_no_cache / time_cache))
+    print('')
+
+
+def compare_columnar():
+    print('Comparing hashing with and without columnar mode, mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('document', 'rows (s)', 'columns (s)', 'ratio'))
+    docs = [
+        ('100000 records of 10 ints', get_records_doc(100000)),
+        ('100000 records of 10 strs', [{key: str(value) for key, value in record.items()}
+                                        for record in get_records_doc(100000)]),
+        ('100000 different dicts', get_heterogeneous_doc(100000)),
+    ]
+    for label, data in docs:
+        time_rows = time_func(get_json_sem_hash, data)
+        time_columns = time_func(partial(get_json_sem_hash, columnar=True), data)
+        print('{:30} {:12.3f} {:12.3f} {:8.2f}'.format(
+            label, time_rows, time_columns, time_rows / time_columns))
+    print('')
+
+
+def compare_numbers():
+    print('Comparing hashing of 10^6 floats, mean of {} samples\n'.format(NUM_SAMPLES))
+    data = {'values': [i / 7 for i in range(10 ** 6)]}
+    print('{:40} {:12.3f}'.format('legacy (s)', time_func(legacy_hash, data)))
+    print('{:40} {:12.3f}'.format('current (s)', time_func(get_json_sem_hash, data)))
+    print('{:40} {:12.3f}'.format('current, packed_numbers (s)',
+                                  time_func(partial(get_json_sem_hash, packed_numbers=True), data)))
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        data = {'values': numpy.array(data['values'])}
+        print('{:40} {:12.3f}'.format('current, packed_numbers, numpy array (s)',
+                                      time_func(partial(get_json_sem_hash, packed_numbers=True), data)))
+    print('')
+
+
+def compare_hashers():
+    print('Comparing speed of hash algorithms, in MB of canonical text per second, '
+          'mean of {} samples\n'.format(NUM_SAMPLES))
+    docs = [
+        ('records', get_records_doc(20000)),
+        ('wide', get_wide_doc(20000)),
+        ('deep', get_deep_doc(20000)),
+        ('text', {'blob{}'.format(i): 'x' * 100000 for i in range(20)}),
+    ]
+    print('{:10}'.format('algorithm') + ''.join(
+        '{:>13} {:>13}'.format(label + ' hash', label + ' digest') for label, _ in docs))
+    sizes = [sum(map(len, iter_canonical_bytes(data))) / 1e6 for _, data in docs]
+    for name, hasher in sorted(HASHERS.items()):
+        speeds = []
+        for (label, data), size in zip(docs, sizes):
+            canonical = b''.join(iter_canonical_bytes(data))
+            speeds.append(size / time_func(partial(get_json_sem_hash, hasher=hasher), data))
+            speeds.append(size / time_func(lambda data: hasher(data).digest(), canonical))
+        print('{:10}'.format(name) + ''.join('{:13.0f} '.format(speed) for speed in speeds))
+    print('(hash: get_json_sem_hash(); digest: hashing of the canonical bytes alone)\n')
+
+
+def compare_canonical_json():
+    print('Comparing hashing of the repr, jcs (canonical JSON) and tagged encodings with hashing '
+          'the output of json.dumps(sort_keys=True), mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>12} {:>12}'.format('document', 'repr (s)', 'jcs (s)', 'tagged (s)',
+                                                     'dumps (s)'))
+
+    def hash_dumps(data):
+        text = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(text.encode('UTF-8')).hexdigest()
+
+    docs = [
+        ('records (20000 x 10 keys)', get_records_doc(20000)),
+        ('wide (100000 keys)', get_wide_doc(100000)),
+        ('floats (100000)', [i / 7 for i in range(100000)]),
+        ('text (20 x 100000 chars)', {'blob{}'.format(i): 'x' * 100000 for i in range(20)}),
+        ('deep (100000 levels)', get_deep_doc(100000)),
+    ]
+    for label, data in docs:
+        time_repr = time_func(get_json_sem_hash, data)
+        time_jcs = time_func(partial(get_json_sem_hash, encoding='jcs'), data)
+        time_tagged = time_func(partial(get_json_sem_hash, encoding='tagged'), data)
+        try:
+            time_dumps = '{:12.3f}'.format(time_func(hash_dumps, data))
+        except RecursionError:
+            time_dumps = 'RecursionError'
+        print('{:30} {:12.3f} {:12.3f} {:12.3f} {:>12}'.format(label, time_repr, time_jcs,
+                                                             time_tagged, time_dumps))
+    print('')
+
+
+def compare_equal():
+    print('Comparing json_sem_equal() with comparing hashes, mean of {} samples\n'.format(
+        NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('documents', 'hashes (s)', 'equal (s)', 'ratio'))
+    records = get_records_doc(20000)
+    wide = get_wide_doc(100000)
+    pairs = [
+        ('equal records', records, get_records_doc(20000)),
+        ('records, last one differs', records, records[:-1] + [{'field_0': 0}]),
+        ('wide, 1 key differs', wide, dict(wide, extra=1)),
+        ('equal wide', wide, get_wide_doc(100000)),
+    ]
+    for label, a, b in pairs:
+        time_hashes = time_func(lambda a: get_json_sem_hash(a) == get_json_sem_hash(b), a)
+        time_equal = time_func(lambda a: json_sem_equal(a, b), a)
+        print('{:30} {:12.3f} {:12.3f} {:8.1f}'.format(
+            label, time_hashes, time_equal, time_hashes / time_equal))
+    print('')
+
+
+def compare_path_filters():
+    print('Comparing exclusion of volatile fields by deep copy and delete, and by exclude '
+          'patterns, mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('document', 'copy (s)', 'exclude (s)', 'ratio'))
+
+    def hash_copy(pods):
+        pods = copy.deepcopy(pods)
+        for pod in pods:
+            del pod['metadata']['generation']
+            del pod['status']
+        return get_json_sem_hash(pods)
+
+    pods = get_pods_doc(5000)
+    time_copy = time_func(hash_copy, pods)
+    time_exclude = time_func(partial(get_json_sem_hash, exclude=['*.metadata.generation',
+                                                                 '*.status']), pods)
+    print('{:30} {:12.3f} {:12.3f} {:8.2f}'.format(
+        'pods (5000)', time_copy, time_exclude, time_copy / time_exclude))
+    print('')
+
+
+def compare_similarity_search():
+    print('Comparing near-duplicate search by computing the similarity with every document, '
+          'and with an LSH index, mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('documents', 'scan (s)', 'index (s)', 'ratio'))
+    # 1000 families of 10 documents; documents of a family differ by 0 to 9 values out of 50
+    docs = []
+    for i in range(10000):
+        doc = {'family{}_key{}'.format(i // 10, j): j for j in range(50)}
+        for key in random.sample(sorted(doc), i % 10):
+            doc[key] = 'changed'
+        docs.append(('doc{}'.format(i), doc))
+    query_doc = docs[0][1]
+    signatures = [(doc_id, get_json_minhash(doc)) for doc_id, doc in docs]
+
+    def scan(query):
+        query = get_json_minhash(query)
+        return [doc_id for doc_id, signature in signatures
+                if sum(map(int.__eq__, query, signature)) >= 0.9 * len(query)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with JsonSimilarityIndex(os.path.join(temp_dir, 'index.db')) as index:
+            index.add_many(docs)
+            time_scan = time_func(scan, query_doc)
+            time_index = time_func(partial(index.query, threshold=0.9), query_doc)
+    print('{:30} {:12.3f} {:12.3f} {:8.2f}'.format(
+        '10000 dicts of 50 keys', time_scan, time_index, time_scan / time_index))
+    print('')
+
+
+def compare_subtree_search():
+    print('Comparing search of the documents that contain a subtree by scanning the documents, '
+          'and with a subtree index, mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8} {:>12}'.format('documents', 'scan (s)', 'index (s)', 'ratio',
+                                                    'index (MB)'))
+    releases = []
+    for i in range(5000):
+        pods = get_pods_doc(3)
+        resources = {'limits': {'cpu': str(i % 4), 'memory': '{}Gi'.format(i % 5)}}
+        for pod in pods:
+            pod['spec']['resources'] = resources
+        releases.append(('release{}'.format(i), pods))
+    fragment = {'limits': {'memory': '1Gi', 'cpu': '2'}}
+
+    def scan(fragment):
+        digest = get_json_sem_merkle(fragment, 'fast128')[1].digest
+        found = []
+        for name, doc in releases:
+            stack = [get_json_sem_merkle(doc, 'fast128')[1]]
+            while stack:
+                node = stack.pop()
+                if node.digest == digest:
+                    found.append(name)
+                elif node.children:
+                    stack.extend(node.children.values() if type(node.children) is dict
+                                 else node.children)
+        return found
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, 'index.db')
+        with JsonSubtreeIndex(db_path) as index:
+            index.add_many(releases)
+            time_scan = time_func(scan, fragment)
+            time_index = time_func(index.find, fragment)
+        size = os.path.getsize(db_path) / 1e6
+    print('{:30} {:12.3f} {:12.4f} {:8.0f} {:12.1f}'.format(
+        'releases (5000 x 3 pods)', time_scan, time_index, time_scan / time_index, size))
+    print('')
+
+
+def compare_event_hasher():
+    print('Comparing peak memory of hashing events of a document that is never built, '
+          'with and without merkle mode\n')
+    print('{:30} {:>12} {:>12}'.format('document', 'time (s)', 'memory (MB)'))
+
+    def hash_events(merkle: bool):
+        hasher = JsonSemEventHasher(merkle=merkle)
+        hasher.start_object()
+        for i in range(2000):
+            hasher.key('series{}'.format(i))
+            hasher.start_array()
+            for j in range(500):
+                hasher.value(j)
+            hasher.end_array()
+        hasher.end_object()
+        return hasher.hexdigest()
+
+    for merkle in (False, True):
+        tracemalloc.start()
+        start = perf_counter()
+        hash_events(merkle)
+        elapsed = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+        print('{:30} {:12.3f} {:12.3f}'.format(
+            '2000 keys x 500 ints, ' + ('merkle' if merkle else 'flat'), elapsed, peak))
+    print('(time is with memory tracing on)\n')
+
+
+def compare_stream_hash():
+    print('Comparing get_json_stream_sem_hash() with json.loads() then get_json_sem_hash(), '
+          'mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('document', 'loads (s)', 'stream (s)', 'ratio'))
+
+    def nest(data, depth: int):
+        for level in range(depth):
+            data = [data] if level % 2 else {'child': data}
+        return data
+
+    ints = list(range(10 ** 6, 3 * 10 ** 6))
+    docs = [
+        ('2M ints (16 MB)', ints),
+        ('2M ints at depth 300', nest(ints, 300)),
+        ('2M ints at depth 900', nest(ints, 900)),
+        ('records (200000 x 10 keys)', get_records_doc(200000)),
+    ]
+    for label, data in docs:
+        text = json.dumps(data).encode('UTF-8')
+        time_loads = time_func(lambda text: get_json_sem_hash(json.loads(text)), text)
+        time_stream = time_func(get_json_stream_sem_hash, text)
+        print('{:30} {:12.3f} {:12.3f} {:8.2f}'.format(
+            label, time_loads, time_stream, time_loads / time_stream))
+    print('')
+
+
+def compare_large_leaves():
+    print('Comparing hashing of documents with large base64 leaves in a thread pool, with large '
+          'leaves copied into the canonical text, and given to the hasher directly, '
+          'mean of {} samples\n'.format(NUM_SAMPLES))
+    print('{:30} {:>12} {:>12} {:>8}'.format('documents', 'copy (s)', 'direct (s)', 'ratio'))
+    docs = [{'name': 'file{}'.format(i),
+             'data': base64.b64encode(os.urandom(10 * 2 ** 20)).decode()} for i in range(16)]
+    large_leaf_size = json_sem_hash.LARGE_LEAF_SIZE
+    for workers in sorted({1, 2, 4, os.cpu_count()}):
+        with ThreadPoolExecutor(workers) as executor:
+            json_sem_hash.LARGE_LEAF_SIZE = sys.maxsize
+            time_copy = time_func(lambda docs: list(executor.map(get_json_sem_hash, docs)), docs)
+            json_sem_hash.LARGE_LEAF_SIZE = large_leaf_size
+            time_direct = time_func(lambda docs: list(executor.map(get_json_sem_hash, docs)), docs)
+        print('{:30} {:12.3f} {:12.3f} {:8.2f}'.format('16 docs of 14 MB, {} threads'.format(workers),
+                                                       time_copy, time_direct, time_copy / time_direct))
+    print('')
+
+
+if __name__ == '__main__':
+    compare_deep_wide()
+    compare_memo()
+    compare_key_order_cache()
+    compare_columnar()
+    compare_numbers()
+    compare_hashers()
+    compare_canonical_json()
+    compare_equal()
+    compare_path_filters()
+    compare_similarity_search()
+    compare_subtree_search()
+    compare_event_hasher()
+    compare_stream_hash()
+    compare_large_leaves()
@@ -0,0 +1,783 @@
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from decimal import Decimal
+from functools import partial
+
+import pytest
+
+import json_sem_hash
+
+from json_sem_hash import (
+    sorted_dict_str, get_json_sem_hash, iter_canonical_bytes, update_json_sem_hash,
+    get_json_sem_merkle, combine_json_sem_nodes, json_sem_diff, rehash_json_patch,
+    get_json_sem_hashes, iter_json_sem_hashes, get_json_stream_sem_hash, iter_json_events,
+    main, get_hasher, register_hasher, HASHERS, get_json_sem_multi_hash,
+    iter_canonical_json, write_canonical_json, json_sem_equal, JsonSemHashCache, JsonSemStore,
+    iter_json_shingles, get_json_minhash, JsonSimilarityIndex, JsonSubtreeIndex,
+    JsonSemEventHasher,
+)
+
+
+def legacy_hash(data, hasher=hashlib.sha256):
+    return hasher(bytes(repr(sorted_dict_str(data)), 'UTF-8')).hexdigest()
+
+
+DOC = {
+    'd1': {'a': 1, 'b': [1, 2]},
+    'd2': {'b': [1, 2], 'a': 1},
+    'L': [1, 2.5, None, True, "it's", 'say "hi"', 'é\n', [], {}],
+}
+
+
+def test_documented_hash():
+    d3 = {'d1': {'a': 1, 'b': [1, 2]}, 'd2': {'b': [1, 2], 'a': 1}, 'L': [1, 2, 3]}
+    d4 = {'d2': {'b': [1, 2], 'a': 1}, 'L': [1, 2, 3], 'd1': {'a': 1, 'b': [1, 2]}}
+    expected = 'e17246aa9136a25581fb859fdeb2dd1da4cda9a221124cd27208646749b85cd7'
+    assert get_json_sem_hash(d3) == expected
+    assert get_json_sem_hash(d4) == expected
+
+
+def test_streamed_same_as_legacy():
+    for data in (DOC, [], {}, 'abc', 123, [DOC, [DOC]]):
+        assert get_json_sem_hash(data) == legacy_hash(data)
+        assert get_json_sem_hash(data, hasher=hashlib.md5) == legacy_hash(data, hashlib.md5)
+
+
+def test_chunking():
+    expected = bytes(repr(sorted_dict_str(DOC)), 'UTF-8')
+    chunks = list(iter_canonical_bytes(DOC, chunk_size=5))
+    assert len(chunks) > 1
+    assert b''.join(chunks) == expected
+
+    hash_obj = hashlib.sha256()
+    update_json_sem_hash(hash_obj, DOC, chunk_size=1)
+    assert hash_obj.hexdigest() == legacy_hash(DOC)
+
+    # container text counts towards the chunk size too
+    for data in ([[]] * 10000, {'k{}'.format(i): {} for i in range(10000)}):
+        chunks = list(iter_canonical_bytes(data, chunk_size=100))
+        assert max(map(len, chunks)) < 120
+        assert b''.join(chunks) == bytes(repr(sorted_dict_str(data)), 'UTF-8')
+        chunks = list(iter_canonical_json(data, chunk_size=100))
+        assert max(map(len, chunks)) < 120
+        assert json.loads(b''.join(chunks)) == data
+
+
+def test_merkle():
+    d3 = {'d1': {'a': 1, 'b': [1, 2]}, 'd2': {'b': [1, 2], 'a': 1}, 'L': [1, 2, 3]}
+    d4 = {'d2': {'b': [1, 2], 'a': 1}, 'L': [1, 2, 3], 'd1': {'a': 1, 'b': [1, 2]}}
+    root_hash, root = get_json_sem_merkle(d3)
+    assert root_hash == root.hexdigest() == get_json_sem_merkle(d4)[0]
+    assert root.children['d1'].digest == root.children['d2'].digest
+    assert root.children['L'].children[0].children is None
+
+    d4['L'].append(4)
+    hash4, root4 = get_json_sem_merkle(d4)
+    assert hash4 != root_hash
+    assert root4.children['d1'].digest == root.children['d1'].digest
+    assert root4.children['L'].digest != root.children['L'].digest
+
+    # leaves, lists and dicts never collide:
+    assert len({get_json_sem_merkle(v)[0] for v in ([], {}, '[]', '{}', [[]], {'': []})}) == 6
+
+
+def test_merkle_combine():
+    _, root = get_json_sem_merkle(DOC)
+    sub_nodes = {key: get_json_sem_merkle(val)[1] for key, val in DOC.items()}
+    assert combine_json_sem_nodes(sub_nodes).digest == root.digest
+    list_node = combine_json_sem_nodes([get_json_sem_merkle(v)[1] for v in DOC['L']])
+    assert list_node.digest == root.children['L'].digest
+
+
+def test_diff():
+    a = {'spec': {'replicas': 2, 'containers': [{'image': 'x:1', 'env': []}]},
+         'meta/data': {'a~b': 1}, 'same': list(range(100))}
+    b = {'same': list(range(100)), 'meta/data': {'a~b': 2},
+         'spec': {'containers': [{'env': [], 'image': 'x:2'}, {}], 'replicas': 2}, 'new': 1}
+    assert json_sem_diff(a, a) == []
+    assert json_sem_diff(a, b) == [
+        '/meta~1data/a~0b', '/new', '/spec/containers/0/image', '/spec/containers/1']
+    assert json_sem_diff([1], {'0': 1}) == ['']
+
+    _, node_a = get_json_sem_merkle(a)
+    assert json_sem_diff(node_a, b) == json_sem_diff(a, b)
+
+
+def test_rehash_json_patch():
+    doc = {'a': {'b': [1, 2, 3], 'c': 'x'}, 'd': [{'e': 1}], 'f/g': 0}
+    _, root = get_json_sem_merkle(doc)
+    patch = [
+        {'op': 'replace', 'path': '/a/b/1', 'value': 20},
+        {'op': 'add', 'path': '/a/b/-', 'value': {'new': True}},
+        {'op': 'add', 'path': '/a/b/0', 'value': 0},
+        {'op': 'remove', 'path': '/a/c'},
+        {'op': 'test', 'path': '/d/0', 'value': {'e': 1}},
+        {'op': 'copy', 'from': '/d/0', 'path': '/d/-'},
+        {'op': 'add', 'path': '/d/1/e', 'value': 2},
+        {'op': 'move', 'from': '/f~1g', 'path': '/h'},
+    ]
+    expected = {'a': {'b': [0, 1, 20, 3, {'new': True}]}, 'd': [{'e': 1}, {'e': 2}], 'h': 0}
+    new_hash, new_root = rehash_json_patch(root, patch)
+    assert new_root is root
+    assert new_hash == get_json_sem_merkle(expected)[0]
+    assert json_sem_diff(new_root, expected) == []
+
+    new_hash, new_root = rehash_json_patch(root, [{'op': 'replace', 'path': '', 'value': [1]}])
+    assert new_hash == get_json_sem_merkle([1])[0]
+
+    # moved or copied subtrees that an earlier operation modified
+    _, root = get_json_sem_merkle({'a': {'b': {'c': 1}}, 'x': {'y': {'z': {}}}})
+    new_hash, _ = rehash_json_patch(root, [
+        {'op': 'replace', 'path': '/a/b/c', 'value': 2},
+        {'op': 'move', 'from': '/a/b', 'path': '/x/y/z/w'},
+    ])
+    assert new_hash == get_json_sem_merkle({'a': {}, 'x': {'y': {'z': {'w': {'c': 2}}}}})[0]
+    _, root = get_json_sem_merkle({'a': {'b': 1}})
+    new_hash, _ = rehash_json_patch(root, [
+        {'op': 'replace', 'path': '/a/b', 'value': 2},
+        {'op': 'copy', 'from': '/a', 'path': '/c'},
+    ])
+    assert new_hash == get_json_sem_merkle({'a': {'b': 2}, 'c': {'b': 2}})[0]
+
+    with pytest.raises(ValueError):
+        rehash_json_patch(new_root, [{'op': 'test', 'path': '/0', 'value': 2}])
+    with pytest.raises(ValueError):
+        rehash_json_patch(new_root, [{'op': 'remove', 'path': '/1'}])
+    with pytest.raises(ValueError):
+        rehash_json_patch(new_root, [{'op': 'add', 'path': '/0/x', 'value': 2}])
+
+
+def test_batch_hashes():
+    docs = [{'i': i, 'L': list(range(i))} for i in range(50)]
+    expected = [get_json_sem_hash(doc, hasher=hashlib.md5) for doc in docs]
+    assert get_json_sem_hashes(docs, hasher=hashlib.md5, workers=1) == expected
+    assert get_json_sem_hashes(iter(docs), hasher=hashlib.md5, workers=2, chunksize=7) == expected
+
+    hashes = iter_json_sem_hashes(docs, workers=2)
+    assert next(hashes) == get_json_sem_hash(docs[0])
+    hashes.close()
+
+
+def test_stream_hash(tmp_path):
+    docs = [DOC, [DOC] * 20, 'abc', -1.5e-7, {'nan': float('nan'), 'big': 10 ** 30}]
+    for data in docs:
+        text = json.dumps(data, indent=2, ensure_ascii=False)
+        expected = get_json_sem_hash(json.loads(text))
+        for chunk_size in (1, 3, 100, 10000):
+            assert get_json_stream_sem_hash(text.encode(), chunk_size=chunk_size) == expected
+        assert get_json_stream_sem_hash(io.BytesIO(text.encode())) == expected
+
+        path = tmp_path / 'doc.json'
+        path.write_text(text, encoding='utf-8')
+        assert get_json_stream_sem_hash(path, hasher=hashlib.md5) == \
+               get_json_sem_hash(data, hasher=hashlib.md5)
+        assert get_json_stream_sem_hash(str(path)) == expected
+
+    # long numbers cut by a read just after '.', 'e' or the exponent sign
+    for text in ('[1234567890.5]', '[1234567890e5]', '[1234567890E+5]', '[-123456789.25e-3]'):
+        expected = get_json_sem_hash(json.loads(text))
+        for chunk_size in range(1, len(text) + 1):
+            assert get_json_stream_sem_hash(text.encode(), chunk_size=chunk_size) == expected
+
+    for bad in ('', '[1,]', '{"a" 1}', '[1] 2', '"abc', '{"a": tru}', '[[]', '[1.]', '[1e+]'):
+        with pytest.raises(ValueError):
+            get_json_stream_sem_hash(bad.encode(), chunk_size=2)
+
+    # large arrays, in batches of items, below many levels of containers
+    data = list(range(1000)) + ['a, b', [1, 2], {'c': [3, 4]}] * 100
+    for level in range(300):
+        data = [data, 'x'] if level % 2 else {'k': data}
+    text = json.dumps(data)
+    for chunk_size in (7, 100, 10000):
+        assert get_json_stream_sem_hash(text.encode(), chunk_size=chunk_size) == \
+               get_json_sem_hash(data)
+
+    # deeper than the json module's decoder can parse
+    deep_list, deep_dict = [], 1
+    for _ in range(4999):
+        deep_list, deep_dict = [deep_list], {'a': deep_dict}
+    assert get_json_stream_sem_hash(b'[' * 5000 + b']' * 5000) == get_json_sem_hash(deep_list)
+    assert get_json_stream_sem_hash(b'{"a":' * 4999 + b'1' + b'}' * 4999) == \
+           get_json_sem_hash(deep_dict)
+
+
+def test_json_events():
+    text = '{"a": [1, 2.5, "x\\"y"], "b": {}, "c": null}'
+    events = list(iter_json_events(io.StringIO(text).read, read_size=2))
+    assert events == [
+        ('start_map', None), ('map_key', 'a'), ('start_array', None), ('value', 1),
+        ('value', 2.5), ('value', 'x"y'), ('end_array', None), ('map_key', 'b'),
+        ('start_map', None), ('end_map', None), ('map_key', 'c'), ('value', None),
+        ('end_map', None)]
+    events = list(iter_json_events(io.StringIO(text).read, read_size=20, small_containers=True))
+    assert ('value', [1, 2.5, 'x"y']) in events
+    assert ('value', {}) in events
+
+    # items of arrays too big for read_size are decoded in batches
+    data = [[1, 2], 'a,b', {'c': [3]}] + list(range(100)) + [1.5, 'x'] * 20
+    events = list(iter_json_events(io.StringIO(json.dumps(data)).read, read_size=50,
+                                   small_containers=True))
+    assert events[0] == ('start_array', None) and events[-1] == ('end_array', None)
+    assert any(event == 'array_items' and len(value) > 5 for event, value in events)
+    items = []
+    for event, value in events[1:-1]:
+        if event == 'array_items':
+            items.extend(value)
+        else:
+            assert event == 'value'
+            items.append(value)
+    assert items == data
+
+
+def test_cli(tmp_path, capsys):
+    docs = [{'b': 1, 'a': [1, 2]}, {'a': [1, 2], 'b': 1}, 'x', [None]]
+    path = tmp_path / 'docs.ndjson'
+    path.write_text('\n'.join(json.dumps(doc) for doc in docs[:2]) + '\n\n' +
+                    '\n'.join(json.dumps(doc) for doc in docs[2:]) + '\n')
+    expected = [get_json_sem_hash(doc, hasher=hashlib.md5) for doc in docs]
+    expected.insert(2, '')
+
+    assert main(['-a', 'md5', str(path)]) == 0
+    assert capsys.readouterr().out.splitlines() == expected
+    assert main(['-a', 'md5', '-w', '2', '-c', '1', str(path), str(path)]) == 0
+    assert capsys.readouterr().out.splitlines() == expected * 2
+
+    path.write_text('[1]\n{bad\n')
+    assert main([str(path)]) == 1
+    assert 'docs.ndjson:2: invalid JSON' in capsys.readouterr().err
+
+
+def test_unordered_lists():
+    a = {'tags': ['x', 'y', 'y'], 'env': [{'name': 'A', 'L': [1, 2]}, {'name': 'B'}], 'L': [1, 2]}
+    b = {'tags': ['y', 'x', 'y'], 'env': [{'name': 'B'}, {'name': 'A', 'L': [1, 2]}], 'L': [1, 2]}
+    assert get_json_sem_hash(a) != get_json_sem_hash(b)
+    assert get_json_sem_hash(a, unordered=True) == get_json_sem_hash(b, unordered=True)
+    assert get_json_sem_hash(a, unordered=['tags', ('env',)]) == \
+           get_json_sem_hash(b, unordered=['tags', ('env',)])
+    assert get_json_sem_hash(a, unordered=['tags']) != get_json_sem_hash(b, unordered=['tags'])
+
+    # multiset, not set; sub-lists matched by wildcard
+    assert get_json_sem_hash(['x', 'y'], unordered=True) != \
+           get_json_sem_hash(['x', 'y', 'y'], unordered=True)
+    assert get_json_sem_hash([[1, 2], [3]], unordered=['*']) == \
+           get_json_sem_hash([[2, 1], [3]], unordered=['*'])
+    assert get_json_sem_hash([[1, 2], [3]], unordered=['*']) != \
+           get_json_sem_hash([[3], [2, 1]], unordered=['*'])
+    assert get_json_sem_hash([2, 1], unordered=['']) == get_json_sem_hash([1, 2], unordered=[''])
+
+    # unmatched lists are as usual
+    assert get_json_sem_hash(a, unordered=['nothing']) == get_json_sem_hash(a)
+
+
+def deep_doc(depth: int, leaf='x'):
+    data = leaf
+    for level in range(depth):
+        data = {'k': data, 'n': level} if level % 2 else [level, data]
+    return data
+
+
+def test_deep_documents():
+    shallow = deep_doc(300)
+    assert get_json_sem_hash(shallow) == legacy_hash(shallow)
+
+    deep = deep_doc(50000)
+    other = deep_doc(50000, leaf='y')
+    assert get_json_sem_hash(deep) != get_json_sem_hash(other)
+    assert get_json_sem_hash(deep, unordered=['nothing']) == get_json_sem_hash(deep)
+    assert get_json_sem_hash(deep, unordered=True) != get_json_sem_hash(other, unordered=True)
+
+    _, node = get_json_sem_merkle(deep)
+    diffs = json_sem_diff(node, other)
+    assert len(diffs) == 1
+    assert diffs[0].endswith('/k/1/k/1')
+
+    cyclic, other = {'a': [1]}, {'a': [1]}
+    cyclic['a'].append(cyclic)
+    other['a'].append(other)
+    for func in (get_json_sem_hash, partial(get_json_sem_hash, unordered=True),
+                 partial(get_json_sem_hash, exclude=['b']), partial(get_json_sem_hash, encoding='jcs'),
+                 partial(get_json_sem_hash, encoding='tagged'), get_json_sem_merkle,
+                 partial(json_sem_equal, other)):
+        with pytest.raises(ValueError):
+            func(cyclic)
+
+
+def test_memo():
+    defaults = {'limits': {'cpu': 1, 'mem': [1, 2]}, 'tags': ['b', 'a']}
+    doc = {'items': [{'name': i, 'defaults': defaults} for i in range(100)],
+           'more': [defaults, [defaults]], 'defaults': defaults}
+    expected = get_json_sem_hash(doc)
+    assert get_json_sem_hash(doc, memo=True) == expected
+    assert b''.join(iter_canonical_bytes(doc, chunk_size=10, memo=True)) == \
+           b''.join(iter_canonical_bytes(doc))
+    assert get_json_sem_hash(doc, memo=True, unordered=True) == get_json_sem_hash(doc, unordered=True)
+    assert get_json_sem_hash(doc, memo=True, unordered=['*.tags']) == \
+           get_json_sem_hash(doc, unordered=['*.tags'])
+
+    root_hash, root = get_json_sem_merkle(doc, memo=True)
+    assert root_hash == get_json_sem_merkle(doc)[0]
+    assert root.children['defaults'] is root.children['items'].children[5].children['defaults']
+
+    circular = {'a': [1]}
+    circular['a'].append(circular)
+    with pytest.raises(ValueError):
+        get_json_sem_hash(circular, memo=True)
+    with pytest.raises(ValueError):
+        get_json_sem_merkle(circular, memo=True)
+
+
+def test_key_order_cache():
+    records = [{'b': i, 'a': [i], 'c': {'y': 1, 'x': 2}} for i in range(500)]
+    records += [{'a': 1, 'b': 2}, {'b': 2, 'a': 1}]
+    assert get_json_sem_hash(records) == legacy_hash(records)
+    # keys that are equal but have different repr don't share cached order
+    for data in ([{1: 'a'}, {True: 'a'}, {1.0: 'a'}], [{True: 'a'}, {1: 'a'}]):
+        assert get_json_sem_hash(data) == legacy_hash(data)
+    heterogeneous = [{'k{}'.format(i): i, 'z': i} for i in range(500)]
+    assert get_json_sem_hash(heterogeneous) == legacy_hash(heterogeneous)
+
+
+def test_columnar():
+    records = [{'id': i, 'v': i / 3, 'name': 'n{}'.format(i), 'big': 2 ** 70 + i, 'flag': i % 2 == 0,
+                'sub': {'L': [{'x': i, 'y': None}, {'y': 1, 'x': 0}]}, 'mixed': [i, 1.5][i % 2]}
+               for i in range(50)]
+    reordered = [dict(reversed(list(record.items()))) for record in records]
+    doc = {'records': records, 'other': [1, 2]}
+    expected = get_json_sem_hash(doc, columnar=True)
+    assert expected != get_json_sem_hash(doc)
+    assert get_json_sem_hash({'other': [1, 2], 'records': reordered}, columnar=True) == expected
+    assert get_json_sem_hash(doc, columnar=True, memo=True) == expected
+
+    records[10]['v'] = 0.0
+    assert get_json_sem_hash(doc, columnar=True) != expected
+    records[10]['v'] = 10 / 3
+    records[10]['sub']['L'][1]['x'] = 1
+    assert get_json_sem_hash(doc, columnar=True) != expected
+    records[10]['sub']['L'][1]['x'] = 0
+    assert get_json_sem_hash(doc, columnar=True) == expected
+
+    # an int column is not a float column or a str column, and order of records matters
+    assert len({get_json_sem_hash(data, columnar=True) for data in (
+        [{'a': 1}, {'a': 2}], [{'a': 1.0}, {'a': 2.0}], [{'a': '1'}, {'a': '2'}],
+        [{'a': 2}, {'a': 1}], [{'a': 1}, {'b': 2}])}) == 5
+    # lists that are not records are hashed as usual
+    assert get_json_sem_hash([{'a': 1}], columnar=True) == get_json_sem_hash([{'a': 1}])
+
+    for unordered in (True, ['records']):
+        with pytest.raises(ValueError):
+            get_json_sem_hash(doc, columnar=True, unordered=unordered)
+
+
+def test_numbers_lists():
+    data = {'ints': list(range(-50, 50)), 'floats': [i / 7 for i in range(100)],
+            'mixed': [1, 2.5] * 10, 'big': [2 ** 70] * 10, 'bools': [True] * 10,
+            'short': [1.5, 2]}
+    assert get_json_sem_hash(data) == legacy_hash(data)
+
+    packed = get_json_sem_hash(data, packed_numbers=True)
+    assert packed != get_json_sem_hash(data)
+    data['floats'][50] += 1e-15
+    assert get_json_sem_hash(data, packed_numbers=True) != packed
+    data['floats'][50] -= 1e-15
+    assert get_json_sem_hash(data, packed_numbers=True) == packed
+    assert get_json_sem_hash(list(range(10)), packed_numbers=True) != \
+           get_json_sem_hash([float(i) for i in range(10)], packed_numbers=True)
+
+
+def test_numpy_arrays(tmp_path):
+    # importing json_sem_hash does not import numpy, which would slow down its startup
+    code = 'import sys, json_sem_hash; assert "numpy" not in sys.modules'
+    subprocess.run([sys.executable, '-c', code], check=True,
+                   env=dict(os.environ, PYTHONPATH=os.path.dirname(json_sem_hash.__file__)))
+
+    numpy = pytest.importorskip('numpy')
+    data = {'ints': list(range(-50, 50)), 'floats': [i / 7 for i in range(100)],
+            'matrix': [[1, 2], [3, 4]], 'short': [1.5, 2.5], 'flags': [True, False]}
+    arrays = {'ints': numpy.arange(-50, 50, dtype='int16'), 'floats': numpy.array(data['floats']),
+              'matrix': numpy.array(data['matrix']), 'short': numpy.array(data['short']),
+              'flags': numpy.array(data['flags'])}
+    assert get_json_sem_hash(arrays) == get_json_sem_hash(data)
+    assert get_json_sem_hash(arrays, packed_numbers=True) == get_json_sem_hash(data, packed_numbers=True)
+    assert get_json_sem_hash([arrays] * 2, columnar=True) == get_json_sem_hash([data] * 2, columnar=True)
+    assert get_json_sem_hash(arrays, encoding='tagged') == get_json_sem_hash(data, encoding='tagged')
+    assert get_json_sem_hash(arrays, encoding='jcs') == get_json_sem_hash(data, encoding='jcs')
+    assert get_json_sem_merkle(arrays)[0] == get_json_sem_merkle(data)[0]
+
+    strided = numpy.arange(40.)[::2]
+    assert get_json_sem_hash(strided, packed_numbers=True) == \
+           get_json_sem_hash(strided.tolist(), packed_numbers=True)
+
+    large = numpy.arange(10000)
+    changed = large.copy()
+    changed[5000] = -1
+    assert json_sem_diff({'x': large}, {'x': changed}) == ['/x/5000']
+
+    # subclasses, whose str() is truncated
+    path = tmp_path / 'large.dat'
+    mapped = numpy.memmap(str(path), dtype=large.dtype, mode='w+', shape=large.shape)
+    mapped[:] = changed
+    masked = numpy.ma.masked_array(changed, mask=changed < 0)
+    masked_list = changed.tolist()
+    masked_list[5000] = None
+    for options in ({}, {'packed_numbers': True}, {'encoding': 'jcs'}, {'encoding': 'tagged'}):
+        assert get_json_sem_hash(mapped, **options) == get_json_sem_hash(changed, **options)
+        assert get_json_sem_hash(masked, **options) == get_json_sem_hash(masked_list, **options)
+    assert get_json_sem_merkle(mapped)[0] == get_json_sem_merkle(changed)[0]
+    assert json_sem_equal(mapped, changed) and not json_sem_equal(mapped, large)
+    assert json_sem_equal(changed.tolist(), mapped)
+    assert set(iter_json_shingles(mapped)) == set(iter_json_shingles(changed))
+    del mapped
+
+
+def test_hashers():
+    assert get_json_sem_hash(DOC, hasher='md5') == get_json_sem_hash(DOC, hasher=hashlib.md5)
+    assert len(get_json_sem_hash(DOC, hasher='fast64')) == 16
+    assert len(get_json_sem_hash(DOC, hasher='fast128')) == 32
+    assert len(get_json_sem_hash(DOC, hasher=get_hasher('blake2b', digest_size=20))) == 40
+    assert get_json_sem_hash(DOC, hasher='sha3_256') == get_json_sem_hash(DOC, hasher=hashlib.sha3_256)
+    assert get_json_sem_merkle(DOC, hasher='fast64')[0] == get_json_sem_merkle(DOC, HASHERS['fast64'])[0]
+    assert get_json_sem_hashes([DOC, [DOC]], hasher='fast64', workers=2) == [
+        get_json_sem_hash(DOC, 'fast64'), get_json_sem_hash([DOC], 'fast64')]
+    assert len(get_json_sem_hash(DOC, 'fast64', unordered=True)) == 16
+    assert len(get_json_sem_hash([DOC] * 2, 'fast64', columnar=True)) == 16
+    _, node = get_json_sem_merkle(DOC, 'md5')
+    assert json_sem_diff(node, DOC, hasher='md5') == []
+    assert rehash_json_patch(node, [], hasher='md5')[0] == node.hexdigest()
+    assert combine_json_sem_nodes(node.children, 'md5').digest == node.digest
+
+    assert b''.join(iter_canonical_bytes(DOC, unordered=True, hasher='md5')) == \
+           b''.join(iter_canonical_bytes(DOC, unordered=True, hasher=hashlib.md5))
+    hash_obj = hashlib.md5()
+    update_json_sem_hash(hash_obj, DOC, unordered=True, hasher='md5')
+    assert hash_obj.hexdigest() == get_json_sem_hash(DOC, hasher='md5', unordered=True)
+
+    for name in ('no-such-hash', 'new', 'file_digest', 'algorithms_available', 'shake_128',
+                 'shake_256'):
+        with pytest.raises(ValueError):
+            get_hasher(name)
+    with pytest.raises(ValueError):
+        get_hasher('sha256', digest_size=8)
+    with pytest.raises(ValueError):
+        get_hasher('blake2s', digest_size=64)
+
+    register_hasher('test-sha1', hashlib.sha1)
+    try:
+        assert get_json_sem_hash(DOC, hasher='test-sha1') == get_json_sem_hash(DOC, hasher=hashlib.sha1)
+    finally:
+        del HASHERS['test-sha1']
+
+
+def test_multi_hash():
+    hashers = ['md5', hashlib.sha256, get_hasher('blake2b', digest_size=8)]
+    expected = [get_json_sem_hash(DOC, hasher) for hasher in hashers]
+    assert get_json_sem_multi_hash(DOC, hashers) == expected
+    assert get_json_sem_multi_hash(DOC, hashers, chunk_size=3, memo=True) == expected
+    assert get_json_sem_multi_hash(DOC, []) == []
+
+
+def test_canonical_json():
+    def canonical_json(data, chunk_size=100):
+        return b''.join(iter_canonical_json(data, chunk_size)).decode('UTF-8')
+
+    # examples of RFC 8785
+    numbers = [333333333.33333329, 1E30, 4.50, 2e-3, 0.000000000000000000000000001]
+    assert canonical_json(numbers) == '[333333333.3333333,1e+30,4.5,0.002,1e-27]'
+    assert canonical_json('\u20ac$\u000F\u000aA\'\u0042\u0022\u005c\\\"/') == (
+        '"\u20ac$\\u000f\\nA\'B\\"\\\\\\\\\\"/"')
+    keys = ['\u20ac', '\r', '\ufb33', '1', '\U0001f600', '\u0080', '\u00f6', '</script>']
+    assert list(json.loads(canonical_json(dict.fromkeys(keys, 0)))) == [
+        '\r', '1', '</script>', '\u0080', '\u00f6', '\u20ac', '\U0001f600', '\ufb33']
+
+    assert canonical_json([-0.0, 1.0, 1e21, 1e20, 1e-7, 2 ** 64, (1, None, True, False)]) == (
+        '[0,1,1e+21,100000000000000000000,1e-7,18446744073709551616,[1,null,true,false]]')
+    assert canonical_json(DOC, chunk_size=1) == json.dumps(
+        DOC, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    with pytest.raises(ValueError):
+        canonical_json([float('nan')])
+    with pytest.raises(TypeError):
+        canonical_json({1: 'a'})
+    with pytest.raises(TypeError):
+        canonical_json({'a': object()})
+
+    # written and hashed in one pass, the same as hashing what was written
+    stream = io.BytesIO()
+    digests = write_canonical_json(DOC, stream, ['md5', hashlib.sha256], chunk_size=5)
+    assert digests == [hashlib.md5(stream.getvalue()).hexdigest(),
+                       get_json_sem_hash(json.loads(stream.getvalue()), encoding='jcs')]
+    assert get_json_sem_hash({'a': [1, 2.0]}, encoding='jcs') == get_json_sem_hash(
+        {'a': [1.0, 2]}, encoding='jcs')
+    assert get_json_sem_hash(DOC, encoding='jcs') != get_json_sem_hash(DOC)
+    with pytest.raises(ValueError):
+        get_json_sem_hash(DOC, encoding='jcs', unordered=True)
+
+
+def test_tagged_encoding():
+    def tagged_hash(data):
+        return get_json_sem_hash(data, encoding='tagged')
+
+    # values that have the same str() get different hashes
+    values = [1, '1', 1.0, True, 'True', None, 'None', [1], [1.0], ['1'], {'1': 1}, {1: 1}]
+    assert len(set(map(tagged_hash, values))) == len(values)
+    assert len(set(map(get_json_sem_hash, values))) < len(values)
+
+    assert tagged_hash(DOC) == tagged_hash(json.loads(json.dumps(DOC)))
+    assert tagged_hash(DOC) != get_json_sem_hash(DOC)
+    assert tagged_hash({'a': 1, 'b': [1, 2]}) == tagged_hash({'b': (1, 2), 'a': 1})
+    # packed and unpacked lists of numbers, and ints beyond 64 bits
+    for numbers in ([1, 2, 3], [1.5, -0.0], [1, 2.0], [2 ** 64, 1], [-2 ** 63, 2 ** 63 - 1]):
+        canonical = b''.join(iter_canonical_bytes(numbers, encoding='tagged', chunk_size=1))
+        assert canonical == b''.join(iter_canonical_bytes(numbers, encoding='tagged'))
+    assert tagged_hash([2 ** 64]) != tagged_hash([0])
+    assert tagged_hash(deep_doc(10000)) == tagged_hash(deep_doc(10000))
+
+    with pytest.raises(TypeError):
+        tagged_hash({'a': object()})
+    with pytest.raises(ValueError):
+        get_json_sem_hash(DOC, encoding='tagged', packed_numbers=True)
+    with pytest.raises(ValueError):
+        get_json_sem_hash(DOC, encoding='utf-8')
+
+
+def test_sem_equal():
+    same = json.loads(json.dumps(DOC))
+    assert json_sem_equal(DOC, same)
+    assert json_sem_equal(DOC, DOC)
+    assert json_sem_equal(deep_doc(10000), deep_doc(10000))
+    # same rules as the hash: values are compared by their str()
+    assert json_sem_equal({'a': [1, 'x']}, {'a': ['1', 'x']})
+    assert json_sem_equal((1, 2), '(1, 2)')
+    pairs = [
+        (DOC, dict(DOC, L=[])), ({'a': 1}, {'b': 1}), ({'a': 1}, {'a': 1, 'b': 2}),
+        ([1, 2], [2, 1]), ([1], [1, 1]), (1, 1.0), ({1: 'x'}, {True: 'x'}), ([], {}),
+        ('[]', []), (deep_doc(10000), deep_doc(10000, leaf='y')),
+    ]
+    for a, b in pairs:
+        assert not json_sem_equal(a, b)
+        assert get_json_sem_hash(a) != get_json_sem_hash(b)
+
+
+def test_include_exclude():
+    pod = {
+        'metadata': {'name': 'web', 'generation': 7, 'labels': {'app': 'web'}},
+        'spec': {'containers': [{'image': 'nginx', 'timestamp': 1}, {'image': 'redis'}]},
+        'status': {'phase': 'Running', 'conditions': [{'timestamp': 2}]},
+        'timestamp': 3,
+    }
+    exclude = ['metadata.generation', '**.timestamp', 'status.**']
+    expected = {
+        'metadata': {'name': 'web', 'labels': {'app': 'web'}},
+        'spec': {'containers': [{'image': 'nginx'}, {'image': 'redis'}]},
+    }
+    assert get_json_sem_hash(pod, exclude=exclude) == legacy_hash(expected)
+    # '*' matches one key, so only the timestamp of the top level is kept
+    assert get_json_sem_hash(pod, exclude=['*.timestamp', 'status']) == legacy_hash(
+        {'metadata': pod['metadata'], 'spec': pod['spec'], 'timestamp': 3})
+    # excluded list items are left out
+    assert get_json_sem_hash(pod, exclude=['spec.containers.0']) == legacy_hash(
+        dict(pod, spec={'containers': [{'image': 'redis'}]}))
+    # a bare str is one pattern
+    assert get_json_sem_hash(pod, exclude='status') == get_json_sem_hash(pod, exclude=['status'])
+    assert get_json_sem_hash(pod, include='metadata') == (
+        legacy_hash({'metadata': pod['metadata']}))
+
+    # included values and the containers that lead to them
+    assert get_json_sem_hash(pod, include=['metadata.name', 'spec.containers.*.image']) == (
+        legacy_hash({'metadata': {'name': 'web'},
+                     'spec': {'containers': [{'image': 'nginx'}, {'image': 'redis'}]}}))
+    assert get_json_sem_hash(pod, include=['metadata'], exclude=['metadata.labels']) == (
+        legacy_hash({'metadata': {'name': 'web', 'generation': 7}}))
+
+    # with unordered lists, which match paths of the document before values are left out
+    shuffled = dict(pod, spec={'containers': pod['spec']['containers'][::-1]})
+    assert get_json_sem_hash(shuffled, unordered=['spec.containers'], exclude=exclude) == (
+        get_json_sem_hash(expected, unordered=['spec.containers']))
+    expected = 'x'
+    for level in range(10000):
+        expected = {'k': expected} if level % 2 else [level, expected]
+    assert get_json_sem_hash(deep_doc(10000), exclude=['**.n']) == get_json_sem_hash(expected)
+
+    with pytest.raises(ValueError):
+        get_json_sem_hash(pod, exclude=['**'])
+    with pytest.raises(ValueError):
+        get_json_sem_hash(pod, exclude=exclude, columnar=True)
+
+
+def test_file_hash_cache(tmp_path):
+    def write(path, text, mtime_ns):
+        with open(str(path), 'w') as stream:  # same inode when rewritten
+            stream.write(text)
+        os.utime(str(path), ns=(mtime_ns, mtime_ns))
+
+    old = int((time.time() - 60) * 1e9)
+    paths = [tmp_path / 'a.json', tmp_path / 'b.json']
+    write(paths[0], '{"a": 1}', old)
+    write(paths[1], '[1, 2]', old)
+    with JsonSemHashCache(tmp_path / 'cache.db') as cache:
+        expected = [get_json_sem_hash({'a': 1}), get_json_sem_hash([1, 2])]
+        assert cache.get_file_hashes(paths) == expected
+        assert cache.get_file_hash(paths[0], 'md5') == get_json_sem_hash({'a': 1}, 'md5')
+
+    # unchanged files are not read again: a change that keeps inode, size and mtime is not seen
+    write(paths[0], '{"a": 2}', old)
+    with JsonSemHashCache(tmp_path / 'cache.db') as cache:
+        assert cache.get_file_hashes(paths) == expected
+        write(paths[0], '{"a": 2}', old + 1)
+        assert cache.get_file_hash(paths[0]) == get_json_sem_hash({'a': 2})
+        # recently modified files are hashed but not cached
+        write(paths[0], '{"a": 3}', int(time.time() * 1e9))
+        assert cache.get_file_hash(paths[0]) == get_json_sem_hash({'a': 3})
+        write(paths[0], '{"a": 4}', int(time.time() * 1e9))
+        assert cache.get_file_hash(paths[0]) == get_json_sem_hash({'a': 4})
+
+        os.remove(str(paths[1]))
+        assert cache.evict_missing() == 1
+        with pytest.raises(OSError):
+            cache.get_file_hash(paths[1])
+
+
+def test_store(tmp_path):
+    snapshots = [dict(DOC, version=i % 3) for i in range(10)]
+    with JsonSemStore(tmp_path / 'store.db') as store:
+        hashes = store.put_many(snapshots)
+        assert hashes == [get_json_sem_hash(doc, encoding='tagged') for doc in snapshots]
+        assert len(store) == 3
+        assert set(store) == set(hashes)
+        assert store.put(dict(reversed(list(snapshots[4].items())))) == hashes[4]
+
+    with JsonSemStore(tmp_path / 'store.db') as store:
+        assert hashes[0] in store
+        assert store.get(hashes[1]) == snapshots[1]
+        assert 'abc' not in store
+        with pytest.raises(KeyError):
+            store.get('abc')
+    with pytest.raises(ValueError):
+        JsonSemStore(tmp_path / 'store.db', algorithm='md5')
+
+    # values of different types are different documents
+    with JsonSemStore(tmp_path / 'types.db') as store:
+        int_hash, str_hash = store.put_many([{'a': 1}, {'a': '1'}])
+        assert int_hash != str_hash
+        assert store.get(int_hash) == {'a': 1} and store.get(str_hash) == {'a': '1'}
+        doc_hash = store.put({'a': (1, 2)})
+        assert get_json_sem_hash(store.get(doc_hash), encoding='tagged') == doc_hash
+        with pytest.raises(ValueError):
+            store.put({1: 'x'})
+        assert len(store) == 3
+    # documents that would not be returned as stored are refused
+    with JsonSemStore(tmp_path / 'repr.db', encoding='repr') as store:
+        for doc in ({1: 'x'}, {'a': (1, 2)}):
+            with pytest.raises(ValueError):
+                store.put(doc)
+        assert len(store) == 0
+
+    with JsonSemStore(tmp_path / 'jcs.db', encoding='jcs') as store:
+        doc_hash = store.put({'a': [1.0, 'x']})
+        assert doc_hash == get_json_sem_hash({'a': [1, 'x']}, encoding='jcs')
+        assert store.get(doc_hash) == {'a': [1, 'x']}
+
+
+def test_similarity_index(tmp_path):
+    assert set(iter_json_shingles({'b': [1, 2], 'a': {}})) == set(iter_json_shingles({'a': {}, 'b': [1, 2]}))
+    assert set(iter_json_shingles([1, 2])) != set(iter_json_shingles([2, 1]))
+    assert set(iter_json_shingles([1, 2], unordered=True)) == set(iter_json_shingles([2, 1], unordered=True))
+    assert len(get_json_minhash(DOC, num_perm=64)) == 64
+
+    base = {'key{}'.format(i): 'value{}'.format(i) for i in range(100)}
+    docs = [('near', dict(base, key0='x')), ('far', {'key{}'.format(i): i for i in range(100)})]
+    with JsonSimilarityIndex(tmp_path / 'index.db') as index:
+        index.add_many(docs)
+        index.add('same', base)
+        assert len(index) == 3
+        results = index.query(base, threshold=0.9)
+        assert dict(results).keys() == {'same', 'near'}
+        assert dict(results)['same'] == 1.0
+        assert index.query(base, threshold=0.9, limit=1) == results[:1]
+
+    with JsonSimilarityIndex(tmp_path / 'index.db') as index:
+        assert index.remove('same')
+        assert not index.remove('same')
+        assert 'same' not in index and 'near' in index
+        assert [doc_id for doc_id, _ in index.query(base)] == ['near']
+    with pytest.raises(ValueError):
+        JsonSimilarityIndex(tmp_path / 'index.db', unordered=True)
+
+
+def test_subtree_index(tmp_path):
+    resources = {'limits': {'cpu': '1', 'memory': '1Gi'}}
+    web = {'containers': [{'name': 'web', 'resources': resources}], 'a/b': resources}
+    db = {'containers': [{'name': 'db', 'resources': dict(reversed(list(resources.items())))}]}
+    with JsonSubtreeIndex(tmp_path / 'index.db') as index:
+        index.add_many([('web', web), ('db', db), ('leaf', 'x')])
+        assert len(index) == 3 and 'leaf' in index
+        assert index.find(resources) == [
+            ('db', '/containers/0/resources'), ('web', '/a~1b'), ('web', '/containers/0/resources')]
+        assert index.find(resources, limit=1) == [('db', '/containers/0/resources')]
+        assert index.find(web) == [('web', '')]
+        assert index.find({}) == []
+
+    with JsonSubtreeIndex(tmp_path / 'index.db') as index:
+        assert index.remove('db')
+        assert not index.remove('db')
+        index.add('web', {'resources': resources})
+        _, node = get_json_sem_merkle(resources, 'fast128')
+        assert index.find(node) == [('web', '/resources')]
+    with pytest.raises(ValueError):
+        JsonSubtreeIndex(tmp_path / 'index.db', algorithm='sha256')
+
+
+def test_event_hasher():
+    for merkle in (False, True):
+        hasher = JsonSemEventHasher(merkle=merkle)
+        hasher.feed(iter_json_events(io.StringIO(json.dumps(DOC)).read, read_size=8))
+        expected = get_json_sem_merkle(DOC)[0] if merkle else get_json_sem_hash(DOC)
+        assert hasher.hexdigest() == expected
+        hasher = JsonSemEventHasher(merkle=merkle)
+        hasher.feed(iter_json_events(io.StringIO(json.dumps([DOC] * 10)).read, read_size=50,
+                                     small_containers=True))
+        expected = get_json_sem_merkle([DOC] * 10)[0] if merkle else get_json_sem_hash([DOC] * 10)
+        assert hasher.hexdigest() == expected
+
+    # events of ijson.basic_parse()
+    hasher = JsonSemEventHasher()
+    hasher.feed([('start_array', None), ('number', 1), ('number', Decimal('2.5')), ('string', 'x'),
+                 ('boolean', True), ('null', None), ('end_array', None)])
+    assert hasher.hexdigest() == get_json_sem_hash([1, 2.5, 'x', True, None])
+
+    hasher = JsonSemEventHasher('md5')
+    hasher.start_object()
+    hasher.key('name')
+    hasher.value('web')
+    hasher.key('ports')
+    hasher.start_array()
+    hasher.value(80)
+    hasher.value({'port': 443})
+    hasher.end_array()
+    with pytest.raises(ValueError):
+        hasher.hexdigest()
+    with pytest.raises(ValueError):
+        hasher.value(1)
+    hasher.end_object()
+    assert hasher.hexdigest() == get_json_sem_hash({'ports': [80, {'port': 443}], 'name': 'web'}, 'md5')
+    with pytest.raises(ValueError):
+        hasher.start_array()
+
+
+def test_large_leaves(monkeypatch):
+    monkeypatch.setattr(json_sem_hash, 'LARGE_LEAF_SIZE', 16)
+    blob = 'QUJDREVGR0hJSktMTU5PUFFSU1RVVldYWVo="+/' * 3
+    doc = {'blob': blob, 'files': [blob.encode(), 'quote\'d ' * 5, b'\x00\xff' * 10, 'x']}
+    chunks = list(iter_canonical_bytes(doc))
+    assert any(type(chunk) is memoryview for chunk in chunks)
+    assert b''.join(chunks) == bytes(repr(sorted_dict_str(doc)), 'UTF-8')
+    assert get_json_sem_hash(doc) == legacy_hash(doc)
+    assert get_json_sem_hash(doc, unordered=True) == get_json_sem_hash(doc, unordered=['**'])
+
+    strs = [blob, 'é' * 20, 'x']
+    tagged = get_json_sem_hash(strs, encoding='tagged')
+    monkeypatch.setattr(json_sem_hash, 'LARGE_LEAF_SIZE', 10 ** 9)
+    assert get_json_sem_hash(strs, encoding='tagged') == tagged